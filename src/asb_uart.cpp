@@ -32,6 +32,8 @@
     }
 
     bool ASB_UART::asbSend(byte type, unsigned int target, unsigned int source, char port, byte len, const byte *data) {
+        if(_binary) return binSend(type, target, source, port, len, data);
+
         byte tlen = 0;
         _interface->write(0x01);
         _interface->print(type,HEX);
@@ -105,6 +107,18 @@
         while(_interface->available()) {
             read = _interface->read();
 
+            //In binary mode the request is only valid between frames, frame contents are not escaped for it
+            if(!_binary || (!_binFrame && !_binEsc && _binLen == _enqState)) {
+                //The last byte of the request is not part of a frame
+                if(binNegotiate(read)) continue;
+            }else{
+                _enqState = 0;
+            }
+            if(_binary) {
+                if(binReceive(read, pkg)) return true;
+                continue;
+            }
+
             if(read == 0x01) bufShift(_buf[0]);
 
             do {
@@ -199,6 +213,142 @@
         return false;
     }
 
+    bool ASB_UART::binNegotiate(byte read) {
+        const byte request[] = {0x05, 'B', '\r', '\n'};
+
+        if(read == request[_enqState]) {
+            _enqState++;
+        }else{
+            _enqState = (read == request[0]) ? 1 : 0;
+        }
+
+        if(_enqState == sizeof(request)) {
+            _enqState = 0;
+            //Acknowledge in ASCII, everything after it is binary
+            _interface->write(0x06);
+            _interface->write('B');
+            _interface->println();
+            _binary = true;
+            _binLen = 0;
+            _binEsc = false;
+            _binFrame = false;
+            return true;
+        }
+        return false;
+    }
+
+    void ASB_UART::binWrite(byte data) {
+        if(data == 0xC0) {
+            _interface->write(0xDB);
+            _interface->write(0xDC);
+        }else if(data == 0xDB) {
+            _interface->write(0xDB);
+            _interface->write(0xDD);
+        }else{
+            _interface->write(data);
+        }
+    }
+
+    bool ASB_UART::binSend(byte type, unsigned int target, unsigned int source, char port, byte len, const byte *data) {
+        unsigned long id;
+        byte crc = 0;
+        byte i;
+
+        if(type > 0x02 || len > 8 || source > 0x7FF) return false;
+        id = ((unsigned long)type << 27) | source;
+        if(type == ASB_PKGTYPE_UNICAST) {
+            if(target > 0x7FF || port < 0 || port > 0x1F) return false;
+            id |= ((unsigned long)port << 22);
+        }
+        id |= ((unsigned long)target << 11);
+
+        _interface->write(0xC0);
+        for(i = 0; i < 4; i++) {
+            crc = crc8(crc, (id >> (24 - 8*i)) & 0xFF);
+            binWrite((id >> (24 - 8*i)) & 0xFF);
+        }
+        crc = crc8(crc, len);
+        binWrite(len);
+        for(i = 0; i < len; i++) {
+            crc = crc8(crc, data[i]);
+            binWrite(data[i]);
+        }
+        binWrite(crc);
+        _interface->write(0xC0);
+        return true;
+    }
+
+    bool ASB_UART::binReceive(byte read, asbPacket &pkg) {
+        unsigned long id;
+        byte crc = 0;
+        byte i;
+
+        if(read == 0xC0) {
+            if(_binLen == 0 && !_binEsc) {
+                //Start of frame
+                _binFrame = true;
+                return false;
+            }
+
+            //End of frame: ID, length, data and CRC
+            _binFrame = false;
+            if(_binLen < 6 || _binLen != _binBuf[4] + 6 || _binBuf[4] > 8) {
+                _binLen = 0;
+                _binEsc = false;
+                return false;
+            }
+            for(i = 0; i < _binLen - 1; i++) crc = crc8(crc, _binBuf[i]);
+            if(crc != _binBuf[_binLen - 1]) {
+                _binLen = 0;
+                _binEsc = false;
+                return false;
+            }
+
+            id = ((unsigned long)_binBuf[0] << 24) | ((unsigned long)_binBuf[1] << 16) | ((unsigned long)_binBuf[2] << 8) | _binBuf[3];
+            pkg.meta.type = (id >> 27) & 0x03;
+            pkg.meta.source = id & 0x7FF;
+            pkg.meta.target = (id >> 11) & 0xFFFF;
+            pkg.meta.port = -1;
+            if(pkg.meta.type == ASB_PKGTYPE_UNICAST) {
+                pkg.meta.port = (id >> 22) & 0x1F;
+                pkg.meta.target &= 0x7FF;
+            }
+            pkg.len = _binBuf[4];
+            for(i = 0; i < pkg.len; i++) pkg.data[i] = _binBuf[5 + i];
+
+            _binLen = 0;
+            return true;
+        }
+
+        if(read == 0xDB) {
+            _binEsc = true;
+            return false;
+        }
+        if(_binEsc) {
+            _binEsc = false;
+            if(read == 0xDC) read = 0xC0;
+            else if(read == 0xDD) read = 0xDB;
+        }
+
+        if(_binLen < sizeof(_binBuf)) {
+            _binBuf[_binLen] = read;
+            _binLen++;
+        }else{
+            _binLen = sizeof(_binBuf) + 1; //too long, discard until next END
+        }
+        return false;
+    }
+
+    byte ASB_UART::crc8(byte crc, byte data) {
+        byte i;
+
+        crc ^= data;
+        for(i = 0; i < 8; i++) {
+            crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+        }
+        return crc;
+    }
+
     byte ASB_UART::asbHexToByte(byte hex) {
         if(hex >= '0' && hex <= '9') return hex-'0';
         if(hex >= 'a' && hex <= 'f') return hex-'a'+10;
@@ -41,6 +41,37 @@
              */
             byte _buf[35];
 
+            /**
+             * Binary framing active, switched on by the host
+             * @see docs/uart_protocol.md
+             */
+            bool _binary = false;
+
+            /**
+             * Number of bytes of the binary mode request (ENQ 'B' CR LF) received so far
+             */
+            byte _enqState = 0;
+
+            /**
+             * Incoming binary frame: 4 byte ID, length, up to 8 data bytes, CRC
+             */
+            byte _binBuf[14];
+
+            /**
+             * Number of bytes in _binBuf
+             */
+            byte _binLen = 0;
+
+            /**
+             * Last byte was a SLIP escape
+             */
+            bool _binEsc = false;
+
+            /**
+             * Inside a binary frame (after the leading END), the mode request is ignored there
+             */
+            bool _binFrame = false;
+
             /**
              * Search for next start byte and shift buffer
              * @return byte start byte found
@@ -53,6 +84,41 @@
              */
             bool bufShift(byte len);
 
+            /**
+             * Check for the binary mode request and acknowledge it
+             * @param read received byte
+             * @return bool request completed with this byte and acknowledged
+             */
+            bool binNegotiate(byte read);
+
+            /**
+             * Send message using binary framing
+             * @see asbSend
+             */
+            bool binSend(byte type, unsigned int target, unsigned int source, char port, byte len, const byte *data);
+
+            /**
+             * Write one byte of a binary frame, escaping END and ESC
+             * @param data byte to write
+             */
+            void binWrite(byte data);
+
+            /**
+             * Process a received byte in binary mode
+             * @param read received byte
+             * @param pkg asbPacket-Reference to store received packet
+             * @return true if a valid frame was completed
+             */
+            bool binReceive(byte read, asbPacket &pkg);
+
+            /**
+             * Update CRC-8 (polynomial 0x07) with one byte
+             * @param crc current CRC
+             * @param data byte to add
+             * @return byte new CRC
+             */
+            byte crc8(byte crc, byte data);
+
         public:
             /**
              * Constructor for UART interface
@@ -0,0 +1,395 @@
+# Vectorized handling of many ASB packets at once, e.g. for analysing recorded bus traffic
+# Requires numpy
+
+from typing import Iterable
+
+import numpy as np
+
+from asysbuslib.asb_proto import AsbMessageType, AsbMeta, AsbPacket
+
+
+ASB_BATCH_DTYPE = np.dtype([
+    ("mtype", np.uint8),
+    ("target", np.uint16),
+    ("source", np.uint16),
+    ("port", np.int8),  # -1 = no port
+    ("len", np.uint8),
+    ("data", np.uint8, (8,)),
+    ("timestamp", np.float64)  # UNIX timestamp, NaN if unknown
+])
+
+# value of the (uppercase) hex digits, -1 for every other byte
+_NIBBLE = np.full(256, -1, dtype=np.int8)
+_NIBBLE[np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)] = np.arange(16)
+
+# maximum number of hex digits per field, longer fields (leading zeros) are accepted like by asb_pkg_decode
+_MAX_DIGITS = 8
+
+
+def asb_can_id_encode_array(records: np.ndarray) -> np.ndarray:
+    """
+    Encode the meta data of many packets to extended CAN identifiers, see asb_can_id_encode
+
+    Parameters:
+        records (np.ndarray): The packets (ASB_BATCH_DTYPE)
+
+    Returns:
+        np.ndarray: The 29 bit identifiers (uint32), 0 for invalid meta data
+    """
+    mtype = records["mtype"].astype(np.uint32)
+    target = records["target"].astype(np.uint32)
+    source = records["source"].astype(np.uint32)
+    port = records["port"].astype(np.int32)
+    unicast = mtype == int(AsbMessageType.ASB_PKGTYPE_UNICAST)
+
+    ok = (mtype <= 2) & (source >= 0x0001) & (source <= 0x07FF) & ((target >= 0x0001) | (mtype == int(AsbMessageType.ASB_PKGTYPE_BROADCAST)))
+    ok &= np.where(unicast, (target <= 0x07FF) & (port >= 0) & (port <= 0x1F), port == -1)
+
+    can_ids = (mtype << 27) | (target << 11) | source
+    can_ids |= np.where(unicast, np.maximum(port, 0).astype(np.uint32) << 22, 0).astype(np.uint32)
+
+    return np.where(ok, can_ids, 0).astype(np.uint32)
+
+
+def asb_can_id_decode_array(can_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode many extended CAN identifiers, see asb_can_id_decode
+
+    Parameters:
+        can_ids (np.ndarray): The identifiers, flags above bit 28 are ignored
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The records (ASB_BATCH_DTYPE, without payload) and a boolean mask of the valid identifiers
+    """
+    can_ids = np.asarray(can_ids).astype(np.uint32)
+    mtype = (can_ids >> 27) & 0x03
+    unicast = mtype == int(AsbMessageType.ASB_PKGTYPE_UNICAST)
+    target = (can_ids >> 11) & 0xFFFF
+
+    records = np.zeros(len(can_ids), dtype=ASB_BATCH_DTYPE)
+    records["mtype"] = mtype
+    records["target"] = np.where(unicast, target & 0x7FF, target)
+    records["source"] = can_ids & 0x7FF
+    records["port"] = np.where(unicast, (can_ids >> 22) & 0x1F, -1)
+    records["timestamp"] = np.nan
+
+    return records, mtype <= 2
+
+
+def _decode_raw(raw: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode all frames in a buffer of the UART protocol
+
+    Every run of hex digits is a field which is terminated by the following non-hex byte (delimiter).
+    A frame is SOH followed by the delimiters US, US, US, US, STX, one US per data byte and EOT.
+
+    Parameters:
+        raw (np.ndarray): The received bytes (uint8)
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The records (ASB_BATCH_DTYPE) of all valid frames and the position of their SOH in raw
+    """
+    nibbles = _NIBBLE[raw]
+    is_delim = nibbles < 0
+    delims = np.flatnonzero(is_delim)
+    starts = np.flatnonzero(raw == 0x01)
+    if len(starts) == 0:
+        return np.zeros(0, dtype=ASB_BATCH_DTYPE), starts
+
+    # value and number of digits of the field terminated by each delimiter
+    delims_before = np.cumsum(is_delim)
+    hexpos = np.flatnonzero(~is_delim)
+    field = delims_before[hexpos]
+    inside = field < len(delims)
+    hexpos, field = hexpos[inside], field[inside]
+    exponent = np.minimum(delims[field] - 1 - hexpos, 8)
+    values = np.bincount(field, weights=nibbles[hexpos].astype(np.int64) << (4 * exponent), minlength=len(delims)).astype(np.int64)
+    digits = np.bincount(field, minlength=len(delims))
+    kinds = raw[delims]
+
+    # delimiter index of every SOH and of the 14 delimiters that may follow it
+    first = delims_before[starts] - 1
+    idx = np.minimum(first[:, None] + np.arange(1, 15), len(delims) - 1)
+
+    header = values[idx[:, :5]]
+    length = header[:, 4]
+    ok = np.all(kinds[idx[:, :4]] == 0x1F, axis=1) & (kinds[idx[:, 4]] == 0x02)
+    ok &= np.all((digits[idx[:, :5]] >= 1) & (digits[idx[:, :5]] <= _MAX_DIGITS), axis=1)
+    ok &= length <= 8
+    length = np.minimum(length, 8)
+    # the EOT has to be within the buffer, frames at its end may have less than 14 following delimiters
+    ok &= first + 6 + length < len(delims)
+
+    # data fields, terminated by US, followed by an empty field terminated by EOT
+    slot = np.arange(8)
+    is_data = slot < length[:, None]
+    data_idx = idx[:, 5:13]
+    ok &= np.all(~is_data | ((kinds[data_idx] == 0x1F) & (digits[data_idx] >= 1) & (digits[data_idx] <= _MAX_DIGITS)
+                             & (values[data_idx] <= 0xFF)), axis=1)
+    eot = idx[np.arange(len(starts)), 5 + length]
+    ok &= (kinds[eot] == 0x04) & (digits[eot] == 0)
+
+    # same rules as asb_validate_pkg
+    mtype, target, source, port = header[:, 0], header[:, 1], header[:, 2], header[:, 3]
+    port = np.where(port == 0xFF, -1, port)
+    ok &= mtype <= 2
+    ok &= (port <= 0x1F) & ((mtype == int(AsbMessageType.ASB_PKGTYPE_UNICAST)) | (port == -1))
+    ok &= ((target >= 0x0001) | (mtype == int(AsbMessageType.ASB_PKGTYPE_BROADCAST))) & (target <= 0xFFFF)
+    ok &= (source >= 0x0001) & (source <= 0x07FF)
+
+    records = np.zeros(np.count_nonzero(ok), dtype=ASB_BATCH_DTYPE)
+    records["mtype"] = mtype[ok]
+    records["target"] = target[ok]
+    records["source"] = source[ok]
+    records["port"] = port[ok]
+    records["len"] = length[ok]
+    records["data"] = np.where(is_data[ok], values[data_idx[ok]], 0)
+    records["timestamp"] = np.nan
+
+    return records, starts[ok]
+
+
+class AsbPacketBatch:
+    """
+    A batch of ASB packets stored as a NumPy structured array (ASB_BATCH_DTYPE)
+
+    Attributes:
+        array (np.ndarray): One record per packet with the fields mtype, target, source, port, len, data[8] and timestamp
+    """
+
+    def __init__(self, array: np.ndarray) -> None:
+        """
+        Initialize the batch
+
+        Parameters:
+            array (np.ndarray): The records (ASB_BATCH_DTYPE)
+        """
+        if array.dtype != ASB_BATCH_DTYPE:
+            raise ValueError("Array must have the dtype ASB_BATCH_DTYPE")
+        self.array = array
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, key) -> "AsbPacketBatch":
+        return AsbPacketBatch(np.atleast_1d(self.array[key]))
+
+    @classmethod
+    def from_bytes(cls, raw: bytes, timestamp: float = np.nan) -> "AsbPacketBatch":
+        """
+        Decode all valid packets in a raw byte log of the serial ASB interface
+
+        Parameters:
+            raw (bytes): The received bytes
+            timestamp (float): Timestamp to assign to all packets (default: unknown)
+
+        Returns:
+            AsbPacketBatch: The decoded packets in order of reception
+        """
+        records, _ = _decode_raw(np.frombuffer(raw, dtype=np.uint8))
+        records["timestamp"] = timestamp
+
+        return cls(records)
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[bytes|str], timestamps: Iterable[float]|None = None) -> "AsbPacketBatch":
+        """
+        Decode all valid packets in a list of lines received from the serial ASB interface
+
+        Parameters:
+            lines (Iterable[bytes|str]): The received lines
+            timestamps (Iterable[float]|None): Reception time of every line
+
+        Returns:
+            AsbPacketBatch: The decoded packets in order of reception, invalid lines are skipped
+        """
+        lines = [(line.encode("ascii", "replace") if isinstance(line, str) else line).rstrip(b"\r\n") for line in lines]
+        raw = np.frombuffer(b"\n".join(lines) + b"\n", dtype=np.uint8)
+        records, starts = _decode_raw(raw)
+
+        if timestamps is not None:
+            timestamps = np.fromiter(timestamps, dtype=np.float64, count=len(lines))
+            records["timestamp"] = timestamps[np.cumsum(raw == 0x0A)[starts]]
+
+        return cls(records)
+
+    @classmethod
+    def from_packets(cls, pkgs: Iterable[AsbPacket], timestamps: Iterable[float]|None = None) -> "AsbPacketBatch":
+        """
+        Create a batch from AsbPacket objects
+
+        Parameters:
+            pkgs (Iterable[AsbPacket]): The packets
+            timestamps (Iterable[float]|None): Reception time of every packet
+
+        Returns:
+            AsbPacketBatch: The batch
+        """
+        pkgs = list(pkgs)
+        records = np.zeros(len(pkgs), dtype=ASB_BATCH_DTYPE)
+        for i, pkg in enumerate(pkgs):
+            records[i] = (pkg.meta.mtype, pkg.meta.target, pkg.meta.source, pkg.meta.port, pkg.len,
+                          (list(pkg.data) + [0] * 8)[:8], np.nan)
+        if timestamps is not None:
+            records["timestamp"] = np.fromiter(timestamps, dtype=np.float64, count=len(pkgs))
+
+        return cls(records)
+
+    @classmethod
+    def from_can_frames(cls, can_ids: Iterable[int], lengths: Iterable[int], data: np.ndarray,
+                        timestamps: Iterable[float]|None = None) -> "AsbPacketBatch":
+        """
+        Create a batch from raw CAN frames, e.g. a candump log
+
+        Parameters:
+            can_ids (Iterable[int]): The extended CAN identifiers
+            lengths (Iterable[int]): The data length of every frame
+            data (np.ndarray): The payload of every frame (uint8, one row of 8 bytes per frame)
+            timestamps (Iterable[float]|None): Reception time of every frame
+
+        Returns:
+            AsbPacketBatch: The packets of all frames with a valid identifier and length
+        """
+        records, ok = asb_can_id_decode_array(np.fromiter(can_ids, dtype=np.uint32))
+        lengths = np.fromiter(lengths, dtype=np.int64, count=len(records))
+        data = np.asarray(data, dtype=np.uint8).reshape(len(records), 8)
+
+        records["len"] = np.minimum(lengths, 8)
+        records["data"] = np.where(np.arange(8) < lengths[:, None], data, 0)
+        if timestamps is not None:
+            records["timestamp"] = np.fromiter(timestamps, dtype=np.float64, count=len(records))
+        ok &= (lengths >= 0) & (lengths <= 8)
+
+        return cls(records[ok])
+
+    def can_ids(self) -> np.ndarray:
+        """
+        Get the extended CAN identifier of every packet
+
+        Returns:
+            np.ndarray: The 29 bit identifiers (uint32), 0 for invalid meta data
+        """
+        return asb_can_id_encode_array(self.array)
+
+    def to_packets(self) -> list[AsbPacket]:
+        """
+        Convert the batch to AsbPacket objects
+
+        Returns:
+            list[AsbPacket]: The packets
+        """
+        return [
+            AsbPacket(AsbMeta(AsbMessageType(int(r["mtype"])), int(r["port"]), int(r["target"]), int(r["source"])),
+                      int(r["len"]), r["data"][:r["len"]].tolist())
+            for r in self.array
+        ]
+
+    def mask(self, mtype: AsbMessageType|None = None, target: int|None = None, port: int|None = None, cmd: int|None = None) -> np.ndarray:
+        """
+        Select packets by the same criteria as AsbInterface.subscribe
+
+        Parameters:
+            mtype (AsbMessageType|None): The message type (None = all types)
+            target (int|None): The target address (None = all targets)
+            port (int|None): The port (None = all ports)
+            cmd (AsbCommand|int|None): The command (None = all commands)
+
+        Returns:
+            np.ndarray: Boolean mask of the matching packets
+        """
+        a = self.array
+        selected = np.ones(len(a), dtype=bool)
+        if mtype is not None:
+            selected &= a["mtype"] == int(mtype)
+        if target is not None:
+            selected &= a["target"] == target
+        if port is not None:
+            selected &= a["port"] == port
+        if cmd is not None:
+            selected &= (a["len"] > 0) & (a["data"][:, 0] == int(cmd))
+
+        return selected
+
+    def filter(self, mtype: AsbMessageType|None = None, target: int|None = None, port: int|None = None, cmd: int|None = None) -> "AsbPacketBatch":
+        """
+        Get the packets matching the same criteria as AsbInterface.subscribe
+
+        Parameters:
+            mtype (AsbMessageType|None): The message type (None = all types)
+            target (int|None): The target address (None = all targets)
+            port (int|None): The port (None = all ports)
+            cmd (AsbCommand|int|None): The command (None = all commands)
+
+        Returns:
+            AsbPacketBatch: The matching packets
+        """
+        return AsbPacketBatch(self.array[self.mask(mtype, target, port, cmd)])
+
+    def count_by(self, field: str = "source") -> dict[int, int]:
+        """
+        Count the packets per value of a field, e.g. the messages sent per node
+
+        Parameters:
+            field (str): The field to group by (mtype, target, source or port)
+
+        Returns:
+            dict[int, int]: Number of packets per value
+        """
+        values, counts = np.unique(self.array[field], return_counts=True)
+
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    # The following functions decode a sensor value of every packet, see asb_pkg_decode_arr_to_*.
+    # Packets with a shorter payload yield meaningless values, filter by cmd first.
+
+    def decode_arr_to_unsigned_int(self, offset: int = 1) -> np.ndarray:
+        """
+        Decode two payload bytes of every packet to an unsigned int
+
+        Parameters:
+            offset (int): Position of the first byte in the payload (default: after the command)
+
+        Returns:
+            np.ndarray: The decoded values (int64)
+        """
+        data = self.array["data"].astype(np.int64)
+        return (data[:, offset] << 8) + data[:, offset + 1]
+
+    def decode_arr_to_signed_int(self, offset: int = 1) -> np.ndarray:
+        """
+        Decode two payload bytes of every packet to a signed int
+
+        Parameters:
+            offset (int): Position of the first byte in the payload (default: after the command)
+
+        Returns:
+            np.ndarray: The decoded values (int64)
+        """
+        aint = self.decode_arr_to_unsigned_int(offset)
+        return np.where(aint > 32768, 1 - (aint - 32768), aint)
+
+    def decode_arr_to_unsigned_long(self, offset: int = 1) -> np.ndarray:
+        """
+        Decode four payload bytes of every packet to an unsigned long
+
+        Parameters:
+            offset (int): Position of the first byte in the payload (default: after the command)
+
+        Returns:
+            np.ndarray: The decoded values (int64)
+        """
+        data = self.array["data"].astype(np.int64)
+        return (data[:, offset] << 24) + (data[:, offset + 1] << 16) + (data[:, offset + 2] << 8) + data[:, offset + 3]
+
+    def decode_arr_to_signed_long(self, offset: int = 1) -> np.ndarray:
+        """
+        Decode four payload bytes of every packet to a signed long
+
+        Parameters:
+            offset (int): Position of the first byte in the payload (default: after the command)
+
+        Returns:
+            np.ndarray: The decoded values (int64)
+        """
+        aint = self.decode_arr_to_unsigned_long(offset)
+        return np.where(aint > 2147483648, 1 - (aint - 2147483648), aint)
@@ -0,0 +1,192 @@
+# Binary framing of the serial ASB interface, see docs/uart_protocol.md
+#
+# A frame is the extended CAN identifier (4 bytes, big endian), the length, the payload
+# and a CRC-8 (polynomial 0x07) over all of them, SLIP-escaped and enclosed in END bytes.
+
+from typing import Iterable, Iterator
+
+from asysbuslib.asb_can import asb_can_id_decode, asb_can_id_encode
+from asysbuslib.asb_proto import AsbMessageType, AsbPacket
+
+
+ASB_BINARY_END = 0xC0
+ASB_BINARY_ESC = 0xDB
+ASB_BINARY_ESC_END = 0xDC
+ASB_BINARY_ESC_ESC = 0xDD
+
+# sent by the host in ASCII mode to request binary framing, the node answers with the acknowledge
+ASB_BINARY_REQUEST = b'\x05B\r\n'
+ASB_BINARY_ACK = b'\x06B\r\n'
+
+# longest unescaped frame body: identifier, length, 8 data bytes, CRC
+ASB_BINARY_MAX_BODY = 14
+
+
+def _crc8_table() -> bytes:
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+_CRC8 = _crc8_table()
+
+
+def asb_binary_crc8(data: bytes) -> int:
+    """
+    Calculate the CRC-8 (polynomial 0x07, initial value 0) of a frame body
+
+    Parameters:
+        data (bytes): The data
+
+    Returns:
+        int: The CRC
+    """
+    crc = 0
+    table = _CRC8
+    for db in data:
+        crc = table[crc ^ db]
+    return crc
+
+
+def asb_binary_encode(pkg: AsbPacket) -> bytes:
+    """
+    Encode an ASB packet to a binary frame
+
+    Parameters:
+        pkg (AsbPacket): The packet to encode
+
+    Returns:
+        bytes: The encoded frame or empty bytes if the packet is invalid
+    """
+    can_id = asb_can_id_encode(pkg.meta)
+    if can_id == 0 or pkg.len < 0 or pkg.len > 8 or len(pkg.data) != pkg.len:
+        return b""
+
+    try:
+        body = can_id.to_bytes(4, 'big') + bytes([pkg.len]) + bytes(pkg.data)
+    except ValueError:  # data bytes out of range
+        return b""
+    body += bytes([asb_binary_crc8(body)])
+
+    return b'\xc0' + body.replace(b'\xdb', b'\xdb\xdd').replace(b'\xc0', b'\xdb\xdc') + b'\xc0'
+
+
+def asb_binary_decode(body: bytes) -> AsbPacket|None:
+    """
+    Decode the unescaped body of a binary frame (without END bytes)
+
+    Parameters:
+        body (bytes): The frame body
+
+    Returns:
+        AsbPacket|None: The decoded ASB packet or None if the frame is invalid
+    """
+    if len(body) < 6 or body[4] > 8 or len(body) != body[4] + 6:
+        return None
+    if asb_binary_crc8(body[:-1]) != body[-1]:
+        return None
+
+    meta = asb_can_id_decode(int.from_bytes(body[:4], 'big'))
+    if meta is None or meta.source < 0x0001 or (meta.target < 0x0001 and meta.mtype != AsbMessageType.ASB_PKGTYPE_BROADCAST):
+        return None
+
+    return AsbPacket(meta, body[4], list(body[5:-1]))
+
+
+class AsbBinaryStreamDecoder:
+    """
+    Incremental decoder for the byte stream of the serial ASB interface in binary mode
+
+    Same interface as AsbStreamDecoder. Frames are delimited by END bytes, so
+    garbage between frames (e.g. the rest of an ASCII line) costs one invalid frame at most.
+
+    Attributes:
+        frames (int): Number of valid packets decoded
+        invalid (int): Number of non-empty frames that could not be decoded
+        dropped_bytes (int): Number of bytes discarded because a frame exceeded the maximum length
+    """
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+
+        self.frames = 0
+        self.invalid = 0
+        self.dropped_bytes = 0
+
+    def reset(self) -> None:
+        """ Discard a partially received frame """
+        self._buf.clear()
+
+    def iter_feed(self, data: bytes) -> Iterator[AsbPacket]:
+        """
+        Feed a chunk of received bytes and decode the completed frames one by one
+
+        Parameters:
+            data (bytes): The received bytes
+
+        Returns:
+            Iterator[AsbPacket]: Generator yielding the decoded packets
+        """
+        if not isinstance(data, bytes):
+            data = bytes(data)
+
+        buf = self._buf
+        end = data.rfind(b'\xc0')
+        if end < 0:
+            frames = []
+            buf += data
+        else:
+            frames = (bytes(buf) + data[:end]).split(b'\xc0')
+            buf[:] = data[end + 1:]
+
+        # an escaped frame is at most twice as long as its body
+        if len(buf) > 2 * ASB_BINARY_MAX_BODY:
+            self.dropped_bytes += len(buf)
+            buf.clear()
+
+        return self._decode_frames(frames)
+
+    def _decode_frames(self, frames: list[bytes]) -> Iterator[AsbPacket]:
+        for frame in frames:
+            if not frame:  # between two END bytes
+                continue
+            if b'\xdb' in frame:
+                frame = frame.replace(b'\xdb\xdc', b'\xc0').replace(b'\xdb\xdd', b'\xdb')
+            pkg = asb_binary_decode(frame)
+            if pkg is None:
+                self.invalid += 1
+                continue
+            self.frames += 1
+            yield pkg
+
+    def feed(self, data: bytes) -> list[AsbPacket]:
+        """
+        Feed a chunk of received bytes and decode the completed frames
+
+        Parameters:
+            data (bytes): The received bytes
+
+        Returns:
+            list[AsbPacket]: The decoded packets in order of reception
+        """
+        return list(self.iter_feed(data))
+
+    def decode_many(self, chunks: Iterable[bytes]) -> list[AsbPacket]:
+        """
+        Feed several chunks of received bytes at once
+
+        Parameters:
+            chunks (Iterable[bytes]): The received chunks in order
+
+        Returns:
+            list[AsbPacket]: The decoded packets of all chunks in order of reception
+        """
+        pkgs: list[AsbPacket] = []
+        for data in chunks:
+            pkgs.extend(self.iter_feed(data))
+
+        return pkgs
@@ -0,0 +1,107 @@
+# Mapping between AsbMeta and the 29 bit extended CAN identifier, see docs/can_protocol.md and src/asb_can.cpp
+#
+# bits 27-28: message type
+# bits 22-26: port (unicast only, part of the target address for other types)
+# bits 11-26: target address (11 bit for unicast, 16 bit for other types)
+# bits  0-10: source address
+
+from asysbuslib.asb_proto import AsbMessageType, AsbMeta
+
+
+ASB_CAN_ID_MASK = 0x1FFFFFFF
+
+_UNICAST = int(AsbMessageType.ASB_PKGTYPE_UNICAST)
+_BROADCAST = int(AsbMessageType.ASB_PKGTYPE_BROADCAST)
+_MESSAGE_TYPES = tuple(AsbMessageType)
+
+
+def asb_can_id_encode(meta: AsbMeta) -> int:
+    """
+    Encode the meta data of a packet to the extended CAN identifier (like asbCanAddrAssemble)
+
+    Besides the checks of asbCanAddrAssemble the meta data has to pass the checks of asb_validate_pkg.
+
+    Parameters:
+        meta (AsbMeta): The meta data
+
+    Returns:
+        int: The 29 bit identifier (without the extended frame flag) or 0 if the meta data is invalid
+    """
+    mtype = meta.mtype
+    target = meta.target
+    source = meta.source
+    if mtype not in (0, 1, 2) or source < 0x0001 or source > 0x07FF or target < 0:
+        return 0
+    if target == 0 and mtype != _BROADCAST:  # only boot and heartbeat broadcasts go to target 0
+        return 0
+
+    if mtype == _UNICAST:
+        port = meta.port
+        if target > 0x07FF or port < 0 or port > 0x1F:
+            return 0
+        return (mtype << 27) | (port << 22) | (target << 11) | source
+
+    if target > 0xFFFF or meta.port != -1:
+        return 0
+    return (mtype << 27) | (target << 11) | source
+
+
+def asb_can_id_decode(can_id: int) -> AsbMeta|None:
+    """
+    Decode an extended CAN identifier to the meta data of a packet (like asbCanAddrParse)
+
+    Parameters:
+        can_id (int): The identifier, flags above bit 28 are ignored
+
+    Returns:
+        AsbMeta|None: The meta data or None if the message type is invalid
+    """
+    mtype = (can_id >> 27) & 0x03
+    if mtype > 2:
+        return None
+
+    target = (can_id >> 11) & 0xFFFF
+    port = -1
+    if mtype == _UNICAST:
+        port = (can_id >> 22) & 0x1F
+        target &= 0x7FF
+
+    return AsbMeta(_MESSAGE_TYPES[mtype], port, target, can_id & 0x7FF)
+
+
+def asb_can_id_filter(mtype: AsbMessageType|None = None, target: int|None = None, port: int|None = None) -> tuple[int, int]:
+    """
+    Get an identifier and mask matching the packets selected by the same criteria as AsbInterface.subscribe
+
+    A packet matches if (can_id & mask) == (identifier & mask). The filter may also match some
+    packets the criteria do not (e.g. a unicast target filter without message type also matches
+    multicast groups with the same lower 11 bits), so the criteria still have to be checked.
+
+    Parameters:
+        mtype (AsbMessageType|None): The message type (None = all types)
+        target (int|None): The target address (None = all targets)
+        port (int|None): The port (None = all ports, -1 = no port)
+
+    Returns:
+        tuple[int, int]: The identifier and the mask (29 bit)
+    """
+    can_id = 0
+    mask = 0
+
+    if mtype is not None:
+        can_id |= int(mtype) << 27
+        mask |= 0x03 << 27
+
+    if target is not None:
+        if mtype is None or mtype == _UNICAST:
+            can_id |= (target & 0x7FF) << 11
+            mask |= 0x7FF << 11
+        else:
+            can_id |= (target & 0xFFFF) << 11
+            mask |= 0xFFFF << 11
+
+    if port is not None and port >= 0:
+        can_id |= (port & 0x1F) << 22
+        mask |= 0x1F << 22
+
+    return can_id, mask
@@ -0,0 +1,308 @@
+# Binary capture of bus traffic: fixed size records in append-only files, read back with mmap
+#
+# File layout (little endian):
+#   header, 24 bytes: magic "ASBCAP\r\n", version (uint16), record size (uint16), reserved (uint32),
+#                     offset from the monotonic clock to the UNIX time in ns (int64)
+#   records, 24 bytes each: monotonic timestamp in ns (int64), extended CAN identifier (uint32, see asb_can.py),
+#                           length (uint8), flags (uint8), 2 padding bytes, data (8 bytes, zero padded)
+
+from typing import Callable, Iterator
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from asysbuslib.asb_can import asb_can_id_decode, asb_can_id_encode
+from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_proto import AsbPacket
+
+
+ASB_CAPTURE_MAGIC = b"ASBCAP\r\n"
+ASB_CAPTURE_VERSION = 1
+
+# record flags
+ASB_CAPTURE_TX = 0x01  # sent by this program, not received
+
+_HEADER = struct.Struct("<8sHHIq")
+_RECORD = struct.Struct("<qIBB2x8s")
+
+
+def asb_capture_files(path: str) -> list[str]:
+    """
+    Get the files of a rotated capture in chronological order
+
+    Parameters:
+        path (str): Path of the current capture file (as passed to AsbCaptureWriter)
+
+    Returns:
+        list[str]: The existing files, oldest first
+    """
+    files = []
+    n = 1
+    while os.path.exists(f"{path}.{n}"):
+        files.append(f"{path}.{n}")
+        n += 1
+    files.reverse()
+    if os.path.exists(path):
+        files.append(path)
+
+    return files
+
+
+class AsbCaptureWriter:
+    """
+    Writes packets as fixed size records to a capture file
+
+    Records are collected in a buffer and written when it is full or flush_interval passed since the
+    last write, so recording costs one write per many packets. With max_bytes the file is rotated
+    like logging.handlers.RotatingFileHandler: path is renamed to path.1, path.1 to path.2 and so on.
+
+    Attributes:
+        records (int): Number of records written (including the buffered ones)
+        skipped (int): Number of packets not recorded, because they can not be encoded as CAN frame
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, backup_count: int = 0, buffer_records: int = 4096,
+                 flush_interval: float = 1.0) -> None:
+        """
+        Initialize the writer and open a new capture file
+
+        An existing file is rotated like on reaching max_bytes instead of appended to, because the
+        time offset in its header is only valid until the host restarts (monotonic clock).
+
+        Parameters:
+            path (str): Path of the capture file
+            max_bytes (int): Rotate when the file would exceed this size (0 = never)
+            backup_count (int): Number of rotated files to keep (0 = keep all)
+            buffer_records (int): Number of records collected before writing
+            flush_interval (float): Maximum time in seconds a record stays in the buffer while packets arrive
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.records = 0
+        self.skipped = 0
+
+        self._buffer = bytearray()
+        self._buffer_size = buffer_records * _RECORD.size
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._rotate_files()
+        self._file = self._open()
+
+    def _open(self):
+        f = open(self.path, "wb")
+        offset = time.time_ns() - time.monotonic_ns()
+        f.write(_HEADER.pack(ASB_CAPTURE_MAGIC, ASB_CAPTURE_VERSION, _RECORD.size, 0, offset))
+        return f
+
+    def write(self, pkg: AsbPacket, flags: int = 0, timestamp_ns: int|None = None) -> bool:
+        """
+        Record a packet
+
+        Parameters:
+            pkg (AsbPacket): The packet
+            flags (int): Record flags (e.g. ASB_CAPTURE_TX)
+            timestamp_ns (int|None): Monotonic timestamp in ns (None = now)
+
+        Returns:
+            bool: False if the packet can not be recorded (invalid meta data or more than 8 data bytes)
+        """
+        can_id = asb_can_id_encode(pkg.meta)
+        if can_id == 0 or pkg.len < 0 or pkg.len > 8 or len(pkg.data) != pkg.len:
+            self.skipped += 1
+            return False
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+
+        record = _RECORD.pack(timestamp_ns, can_id, pkg.len, flags, bytes(pkg.data))
+        with self._lock:
+            self._buffer += record
+            self.records += 1
+            if len(self._buffer) >= self._buffer_size or time.monotonic() - self._last_flush >= self._flush_interval:
+                self._flush()
+
+        return True
+
+    def flush(self) -> None:
+        """ Write the buffered records """
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        """ Write the buffered records and close the file """
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+
+        if self.max_bytes > 0 and self._file.tell() > _HEADER.size and self._file.tell() + len(self._buffer) > self.max_bytes:
+            self._rotate()
+
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._rotate_files()
+        self._file = self._open()
+
+    def _rotate_files(self) -> None:
+        files = asb_capture_files(self.path)[:-1]  # rotated files, oldest first
+        for n in range(len(files), 0, -1):
+            if self.backup_count > 0 and n >= self.backup_count:
+                os.remove(f"{self.path}.{n}")
+            else:
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class AsbCaptureTee(AsbComm):
+    """
+    Records all packets received and sent through another communication interface
+
+    Received packets are recorded before the callbacks are called, sent packets after they
+    were sent successfully (with flag ASB_CAPTURE_TX).
+    """
+
+    def __init__(self, comm: AsbComm, writer: AsbCaptureWriter) -> None:
+        """
+        Initialize the tee
+
+        Parameters:
+            comm (AsbComm): The communication interface (e.g. AsbUart)
+            writer (AsbCaptureWriter): The capture writer
+        """
+        self._comm = comm
+        self._writer = writer
+        comm.register_callback(self._record)
+
+    def _record(self, pkg: AsbPacket|None) -> None:
+        if pkg is not None:
+            self._writer.write(pkg)
+
+    def stop(self) -> None:
+        """ Stop the communication interface (if it can be stopped) and close the capture """
+        stop = getattr(self._comm, "stop", None)
+        if stop:
+            stop()
+        self._writer.close()
+
+    def register_callback(self, callback: Callable[[AsbPacket|None], None]) -> None:
+        self._comm.register_callback(callback)
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        if not self._comm.send_packet(pkg):
+            return False
+        self._writer.write(pkg, ASB_CAPTURE_TX)
+        return True
+
+
+class AsbCaptureReader:
+    """
+    Reads a capture file through a read-only memory map
+
+    Records written after opening are not visible, a partially written last record is ignored.
+    Use as context manager or call close.
+
+    Attributes:
+        time_offset_ns (int): Offset from the monotonic timestamps of the records to the UNIX time in ns
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Open a capture file
+
+        Parameters:
+            path (str): Path of the capture file
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < _HEADER.size:
+            self._mmap.close()
+            raise ValueError(f"{path} is no capture file")
+        magic, version, record_size, _, self.time_offset_ns = _HEADER.unpack_from(self._mmap)
+        if magic != ASB_CAPTURE_MAGIC or version != ASB_CAPTURE_VERSION or record_size != _RECORD.size:
+            self._mmap.close()
+            raise ValueError(f"{path} is no capture file of version {ASB_CAPTURE_VERSION}")
+
+        self._count = (len(self._mmap) - _HEADER.size) // _RECORD.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self) -> "AsbCaptureReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ Unmap the file, raises BufferError while arrays returned by array still exist """
+        self._mmap.close()
+
+    def records(self) -> Iterator[tuple[int, int, int, int, bytes]]:
+        """
+        Iterate over the raw records, unpacked directly from the mapped file
+
+        Returns:
+            Iterator[tuple[int, int, int, int, bytes]]: Timestamp (ns), CAN identifier, length, flags and data (8 bytes) per record
+        """
+        view = memoryview(self._mmap)[_HEADER.size:_HEADER.size + self._count * _RECORD.size]
+        try:
+            yield from _RECORD.iter_unpack(view)
+        finally:
+            view.release()
+
+    def packets(self) -> Iterator[tuple[int, AsbPacket, int]]:
+        """
+        Iterate over the recorded packets
+
+        Returns:
+            Iterator[tuple[int, AsbPacket, int]]: Timestamp (monotonic ns), packet and flags per record
+        """
+        for timestamp, can_id, length, flags, data in self.records():
+            meta = asb_can_id_decode(can_id)
+            if meta is None or length > 8:
+                continue
+            yield timestamp, AsbPacket(meta, length, list(data[:length])), flags
+
+    def array(self):
+        """
+        Get the records as NumPy structured array, a view of the mapped file without copying (requires numpy)
+
+        Returns:
+            np.ndarray: Fields timestamp, can_id, len, flags and data[8]
+        """
+        import numpy as np
+
+        dtype = np.dtype({
+            "names": ["timestamp", "can_id", "len", "flags", "data"],
+            "formats": ["<i8", "<u4", "u1", "u1", ("u1", (8,))],
+            "offsets": [0, 8, 12, 13, 16],
+            "itemsize": _RECORD.size
+        })
+        return np.frombuffer(self._mmap, dtype=dtype, count=self._count, offset=_HEADER.size)
+
+    def to_batch(self):
+        """
+        Convert the records to an AsbPacketBatch with UNIX timestamps (requires numpy)
+
+        Returns:
+            AsbPacketBatch: The packets
+        """
+        from asysbuslib.asb_batch import AsbPacketBatch
+
+        records = self.array()
+        return AsbPacketBatch.from_can_frames(records["can_id"], records["len"], records["data"],
+                                              (records["timestamp"] + self.time_offset_ns) / 1e9)
@@ -0,0 +1,153 @@
+from collections import deque
+from enum import Enum
+from typing import Callable
+
+import logging
+import threading
+
+from asysbuslib.asb_proto import AsbPacket
+
+
+# default number of packets that may wait per worker
+ASB_DISPATCH_QUEUE_LEN = 1024
+
+
+class AsbBackpressure(Enum):
+    """ What to do with a received packet when the queue of its worker is full """
+    BLOCK = 1  # wait until the worker took a packet (the reader stalls)
+    DROP_OLDEST = 2  # discard the oldest waiting packet
+    DROP_NEWEST = 3  # discard the received packet
+
+
+class _AsbDispatchWorker:
+
+    def __init__(self, dispatcher: "AsbDispatcher", name: str) -> None:
+        self.queue: deque[AsbPacket] = deque()
+        self.cond = threading.Condition()
+        self.dispatched = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.thread = threading.Thread(target=dispatcher._run, args=(self,), name=name, daemon=True)
+
+
+class AsbDispatcher:
+    """
+    Runs packet callbacks on a pool of worker threads
+
+    Packets are distributed to the workers by their source address, so the packets of one node
+    are always handled in order of reception while slow callbacks for one node do not delay the others.
+    Each worker has a bounded queue, the policy decides what happens when it is full.
+
+    Callback exceptions are logged and do not stop the worker.
+    """
+
+    def __init__(self, callback: Callable[[AsbPacket], None], workers: int = 4, max_queue: int = ASB_DISPATCH_QUEUE_LEN,
+                 policy: AsbBackpressure = AsbBackpressure.BLOCK) -> None:
+        """
+        Initialize the dispatcher and start the worker threads
+
+        Parameters:
+            callback (function): The function to call for every packet (def my_callback(pkg: AsbPacket) -> None)
+            workers (int): Number of worker threads
+            max_queue (int): Maximum number of packets waiting per worker
+            policy (AsbBackpressure): What to do when a queue is full
+        """
+        if workers < 1 or max_queue < 1:
+            raise ValueError("At least one worker and a queue length of at least 1 are required")
+
+        self._callback = callback
+        self._max_queue = max_queue
+        self._policy = policy
+        self._running = True
+
+        self._workers = [_AsbDispatchWorker(self, f"AsbDispatcher-{i}") for i in range(workers)]
+        for worker in self._workers:
+            worker.thread.start()
+
+    @property
+    def dispatched(self) -> int:
+        """ Number of packets handed to the callback """
+        return sum(worker.dispatched for worker in self._workers)
+
+    @property
+    def dropped(self) -> int:
+        """ Number of packets discarded because a queue was full """
+        return sum(worker.dropped for worker in self._workers)
+
+    @property
+    def max_depth(self) -> int:
+        """ Highest number of packets that waited in a single queue """
+        return max(worker.max_depth for worker in self._workers)
+
+    @property
+    def queue_depth(self) -> int:
+        """ Number of packets currently waiting in all queues """
+        return sum(len(worker.queue) for worker in self._workers)
+
+    def put(self, pkg: AsbPacket) -> bool:
+        """
+        Queue a packet for its worker, called from the reader thread
+
+        Parameters:
+            pkg (AsbPacket): The received packet
+
+        Returns:
+            bool: False if the packet was dropped
+        """
+        worker = self._workers[pkg.meta.source % len(self._workers)]
+
+        with worker.cond:
+            queue = worker.queue
+            if len(queue) >= self._max_queue:
+                if self._policy == AsbBackpressure.BLOCK:
+                    while len(queue) >= self._max_queue and self._running:
+                        worker.cond.wait()
+                elif self._policy == AsbBackpressure.DROP_OLDEST:
+                    queue.popleft()
+                    worker.dropped += 1
+                else:
+                    worker.dropped += 1
+                    return False
+            if not self._running:
+                return False
+
+            queue.append(pkg)
+            if len(queue) > worker.max_depth:
+                worker.max_depth = len(queue)
+            worker.cond.notify_all()
+
+        return True
+
+    def stop(self, drain: bool = True) -> None:
+        """
+        Stop the worker threads
+
+        Parameters:
+            drain (bool): Handle the packets that are still queued before stopping
+        """
+        self._running = False
+        for worker in self._workers:
+            with worker.cond:
+                if not drain:
+                    worker.queue.clear()
+                worker.cond.notify_all()
+        for worker in self._workers:
+            if worker.thread is not threading.current_thread():
+                worker.thread.join()
+
+    def _run(self, worker: _AsbDispatchWorker) -> None:
+        queue = worker.queue
+        while True:
+            with worker.cond:
+                while not queue and self._running:
+                    worker.cond.wait()
+                if not queue:
+                    return
+                pkg = queue.popleft()
+                worker.cond.notify_all()  # a blocked reader may continue
+
+            try:
+                self._callback(pkg)
+            except Exception:
+                logging.getLogger(__name__).exception("Packet callback failed")
+            worker.dispatched += 1
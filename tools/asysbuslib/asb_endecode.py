@@ -23,7 +23,9 @@ def asb_validate_pkg(pkg: AsbPacket) -> bool:
     if pkg.meta.mtype != AsbMessageType.ASB_PKGTYPE_UNICAST and pkg.meta.port != -1:
         return False
 
-    if pkg.meta.target < 0x0001 or pkg.meta.target > 0xFFFF:
+    # the nodes send boot and heartbeat broadcasts to target 0
+    min_target = 0x0000 if pkg.meta.mtype == AsbMessageType.ASB_PKGTYPE_BROADCAST else 0x0001
+    if pkg.meta.target < min_target or pkg.meta.target > 0xFFFF:
         return False
 
     if pkg.meta.source < 0x0001 or pkg.meta.source > 0x07FF:
@@ -79,6 +81,111 @@ def asb_pkg_encode(pkg: AsbPacket) -> str:
     return out.upper()
 
 
+# maximum length of an encoded packet: SOH, type, target (4), source (3), port (2), len, separators,
+# 8 data bytes with separators, EOT and CRLF
+ASB_PKG_ENCODED_MAX_LEN = 44
+
+_UNICAST = int(AsbMessageType.ASB_PKGTYPE_UNICAST)
+_BROADCAST = int(AsbMessageType.ASB_PKGTYPE_BROADCAST)
+
+# uppercase hex representation of a byte (without leading zero) followed by a unit separator
+_BYTE_TO_HEX_US: dict[int, bytes] = {i: format(i, 'X').encode() + b'\x1f' for i in range(0x100)}
+# same for addresses, filled on demand with the addresses seen on the bus
+_ADDR_TO_HEX_US: dict[int, bytes] = dict(_BYTE_TO_HEX_US)
+_TYPE_TO_HEADER: tuple[bytes, ...] = tuple(b'\x01%X\x1f' % i for i in range(3))
+_LEN_TO_HEX_STX: tuple[bytes, ...] = tuple(b'%X\x02' % i for i in range(9))
+_PORT_NONE_US = b'FF\x1f'
+_TRAILER = b'\x04\r\n'
+
+
+def _asb_pkg_encode_parts(pkg: AsbPacket) -> list[bytes]|None:
+    """ Validate pkg (same rules as asb_validate_pkg) and return the pieces of its encoded form """
+    meta = pkg.meta
+    mtype = meta.mtype
+    port = meta.port
+    target = meta.target
+    source = meta.source
+    data = pkg.data
+
+    if mtype not in (0, 1, 2) or port < -1 or port > 0x1F or (mtype != _UNICAST and port != -1):
+        return None
+    if target < (0x0000 if mtype == _BROADCAST else 0x0001) or target > 0xFFFF or source < 0x0001 or source > 0x07FF:
+        return None
+    if pkg.len < 0 or pkg.len > 8 or len(data) != pkg.len:
+        return None
+
+    addr_to_hex = _ADDR_TO_HEX_US
+    target_hex = addr_to_hex.get(target)
+    if target_hex is None:
+        target_hex = addr_to_hex[target] = b'%X\x1f' % target
+    source_hex = addr_to_hex.get(source)
+    if source_hex is None:
+        source_hex = addr_to_hex[source] = b'%X\x1f' % source
+
+    byte_to_hex = _BYTE_TO_HEX_US
+    try:
+        parts = [
+            _TYPE_TO_HEADER[mtype],
+            target_hex,
+            source_hex,
+            _PORT_NONE_US if port < 0 else byte_to_hex[port],
+            _LEN_TO_HEX_STX[pkg.len]
+        ]
+        parts += [byte_to_hex[db] for db in data]
+    except KeyError:  # data bytes out of range
+        return None
+    parts.append(_TRAILER)
+
+    return parts
+
+
+def asb_pkg_encode_bytes(pkg: AsbPacket) -> bytes:
+    """
+    Encode an ASB packet to bytes to send to the serial ASB interface
+
+    Same output as asb_pkg_encode, but assembled from precomputed hex tables
+    instead of building and upper-casing intermediate strings.
+
+    Parameters:
+        pkg (AsbPacket): The packet to encode
+
+    Returns:
+        bytes: The encoded packet or empty bytes if the packet is invalid
+    """
+    parts = _asb_pkg_encode_parts(pkg)
+    if parts is None:
+        return b""
+
+    return b"".join(parts)
+
+
+def asb_pkg_encode_into(buf: bytearray|memoryview, offset: int, pkg: AsbPacket) -> int:
+    """
+    Encode an ASB packet into an existing buffer
+
+    This allows packing many packets into one reusable buffer, e.g. for a single write to the serial port.
+    A bytearray grows as needed if offset is at most its length, a memoryview has to provide
+    at least ASB_PKG_ENCODED_MAX_LEN bytes starting at offset.
+
+    Parameters:
+        buf (bytearray|memoryview): The buffer to write to
+        offset (int): The position in buf to write the packet to
+        pkg (AsbPacket): The packet to encode
+
+    Returns:
+        int: The number of bytes written, 0 if the packet is invalid
+    """
+    parts = _asb_pkg_encode_parts(pkg)
+    if parts is None:
+        return 0
+
+    frame = b"".join(parts)
+    end = offset + len(frame)
+    buf[offset:end] = frame
+
+    return end - offset
+
+
 # based on tools/decoder.py
 def asb_pkg_decode(line: str) -> AsbPacket|None:
     """
@@ -118,6 +225,90 @@ def asb_pkg_decode(line: str) -> AsbPacket|None:
     return pkg
 
 
+# lookup table for the one and two digit (uppercase) hex fields of the UART protocol
+_HEX_TO_INT: dict[bytes, int] = {format(i, fmt).encode(): i for fmt in ('X', '02X') for i in range(0x100)}
+
+_MESSAGE_TYPES = tuple(AsbMessageType)
+
+# bytes allowed between SOH and STX and between STX and EOT
+_FIELD_CHARS = b'0123456789ABCDEF\x1f'
+
+
+def asb_pkg_decode_bytes(line: bytes) -> AsbPacket|None:
+    """
+    Decode an ASB packet from a raw line received from the serial ASB interface
+
+    This is the fast path of asb_pkg_decode: it works on bytes without regular expressions
+    and only returns packets that pass the same checks as asb_validate_pkg.
+    A port of 0xFF is decoded as -1 (no port), like the signed port of the C implementation.
+
+    Parameters:
+        line (bytes): The line to decode
+
+    Returns:
+        AsbPacket|None: The decoded ASB packet or None if the line is not a valid ASB packet
+    """
+    # like the regular expression of asb_pkg_decode, the frame starts at the first SOH followed by
+    # four US separated header fields, STX, data fields each terminated by US and EOT
+    start = line.find(b'\x01')
+    while True:
+        if start < 0:
+            return None
+        next_start = line.find(b'\x01', start + 1)
+        end = line.find(b'\x04', start, next_start if next_start >= 0 else len(line))
+        if end >= 0:
+            header, stx, data = line[start + 1:end].partition(b'\x02')
+            if (stx and header.count(b'\x1f') == 4 and not header.translate(None, _FIELD_CHARS)
+                    and not data.translate(None, _FIELD_CHARS) and (not data or data[-1] == 0x1F)):
+                break
+        start = next_start
+
+    fields = header.split(b'\x1f')
+    data_fields = data.split(b'\x1f')  # data bytes..., ''
+
+    hex_to_int = _HEX_TO_INT
+    try:
+        mtype = hex_to_int[fields[0]]
+        target = fields[1]
+        if len(target) <= 2:
+            target = hex_to_int[target]
+        else:
+            target = (hex_to_int[target[:-2]] << 8) | hex_to_int[target[-2:]]
+        source = fields[2]
+        if len(source) <= 2:
+            source = hex_to_int[source]
+        else:
+            source = (hex_to_int[source[:-2]] << 8) | hex_to_int[source[-2:]]
+        port = hex_to_int[fields[3]]
+        length = hex_to_int[fields[4]]
+        data = [hex_to_int[db] for db in data_fields[:-1]]
+    except KeyError:
+        # empty or longer fields (e.g. leading zeros), parsed like asb_pkg_decode does
+        try:
+            mtype, target, source, port, length = (int(f, 16) for f in fields)
+            data = [int(db, 16) for db in data_fields[:-1]]
+        except ValueError:
+            return None
+        if any(db > 0xFF for db in data):
+            return None
+
+    if length > 8 or len(data) != length:
+        return None
+
+    if port == 0xFF:
+        port = -1
+
+    # same rules as asb_validate_pkg
+    if mtype > 2:
+        return None
+    if port > 0x1F or (mtype != _UNICAST and port != -1):
+        return None
+    if (target < 0x0001 and mtype != _BROADCAST) or target > 0xFFFF or source < 0x0001 or source > 0x07FF:
+        return None
+
+    return AsbPacket(AsbMeta(_MESSAGE_TYPES[mtype], port, target, source), length, data)
+
+
 def asb_pkg_decode_arr_to_unsigned_int(arr: list[int]) -> int:
     """
     Decode an array of two bytes to an unsigned int
@@ -1,88 +1,312 @@
-from typing import Callable
-
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+import itertools
+import logging
+import math
+import operator
+import threading
 import time
 
 from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_metrics import AsbHistogram, AsbMetrics
 from asysbuslib.asb_node import AsbNode, AsbIoModule, AsbIoModuleType
 from asysbuslib.asb_proto import AsbMessageType, AsbCommand, AsbMeta, AsbPacket
+from asysbuslib.asb_state import AsbStateStore, ASB_STATE_COMMANDS
+from asysbuslib.asb_timer import AsbTimerScheduler
 
 
 PING_TIMEOUT_SEC = 1.0
+NODE_RATE_TAU_SEC = 10.0  # time constant of the per node message rate average
+SLOW_CALLBACK_SEC = 0.05
+STATE_REPLY_WINDOW_SEC = 1.0  # at most one state reply per group in this time
+
+
+@dataclass(eq=False)
+class AsbSubscription:
+    """
+    Subscription handle returned by AsbInterface.subscribe
+
+    Attributes:
+        callback (function): The callback function (def my_callback(pkg: AsbPacket) -> None)
+        mtype (AsbMessageType|None): The message type subscribed to (None = all types)
+        target (int|None): The target address subscribed to (None = all targets)
+        port (int|None): The port subscribed to (None = all ports)
+        cmd (int|None): The command subscribed to (None = all commands)
+        calls (int): Number of timed callback calls (only counted with profiling or metrics enabled)
+        total_time (float): Time in seconds spent in these calls
+        max_time (float): Longest of these calls in seconds
+        slow_calls (int): Number of calls that took at least the slow callback threshold
+    """
+    callback: Callable[[AsbPacket], None]
+    mtype: AsbMessageType|None
+    target: int|None
+    port: int|None
+    cmd: int|None
+
+    seq: int = field(default=0, repr=False)
+    calls: int = field(default=0, repr=False)
+    total_time: float = field(default=0.0, repr=False)
+    max_time: float = field(default=0.0, repr=False)
+    slow_calls: int = field(default=0, repr=False)
+
+    def describe(self) -> str:
+        """ Get the callback and the filter as text, e.g. for logging """
+        name = getattr(self.callback, "__qualname__", repr(self.callback))
+        return f"{name} (mtype={self.mtype}, target={self.target}, port={self.port}, cmd={self.cmd})"
+
+
+def _subscription_key_getter(mask: int) -> Callable[[tuple], object]:
+    """ Get a function returning the fields (mtype, target, port, cmd) selected by mask as dict key """
+    fields = [i for i in range(4) if mask & (1 << i)]
+    if not fields:
+        return lambda values: ()
+    return operator.itemgetter(*fields)
+
+
+# one key function per combination of filtered fields
+_SUBSCRIPTION_KEY_GETTERS = [_subscription_key_getter(mask) for mask in range(16)]
 
 
 class AsbInterface:
 
-    def __init__(self, node_id: int, comm: AsbComm) -> None:
+    def __init__(self, node_id: int, comm: AsbComm, scheduler=None, metrics: AsbMetrics|None = None,
+                 profile_callbacks: bool = False, slow_callback_sec: float = SLOW_CALLBACK_SEC,
+                 states: AsbStateStore|None = None) -> None:
+        """
+        Initialize the ASB interface
+
+        With metrics the received packets, invalid packets and callback exceptions are counted
+        and the time of every subscription callback is recorded per callback name (subscriptions of the
+        same function share a histogram, so temporary subscriptions do not add metrics).
+
+        With profile_callbacks or metrics every subscription callback is timed: the statistics are
+        kept on the subscription (see get_slowest_subscriptions) and calls taking at least
+        slow_callback_sec are logged as warning with the subscription and the packet.
+
+        The last on/off and percent value of every multicast group is kept in the states attribute.
+
+        Parameters:
+            node_id (int): The node ID of this interface on the bus
+            comm (AsbComm): The communication interface
+            scheduler (AsbTimerScheduler|asyncio.AbstractEventLoop|None): Runs timeouts (call_later), None = own AsbTimerScheduler thread
+            metrics (AsbMetrics|None): Record counters and latencies (None = disabled)
+            profile_callbacks (bool): Time the subscription callbacks
+            slow_callback_sec (float): Log callbacks taking at least this time in seconds
+            states (AsbStateStore|None): Store for the group states, e.g. with TTL or loaded from a file (None = new store)
+        """
         self._node_id = node_id
         self._comm = comm
+        self._metrics = metrics
+        self._profile_callbacks = profile_callbacks or metrics is not None
+        self._slow_callback_sec = slow_callback_sec
+        self._callback_histograms: dict[int, AsbHistogram] = {}
+
+        self._own_scheduler = scheduler is None
+        self._scheduler = scheduler if scheduler is not None else AsbTimerScheduler()
 
         self._comm.register_callback(self._callback)
 
-        self._subscribe_list: list[dict] = []
-        self._pings_pending: list[dict] = []
-        self._known_nodes: list[AsbNode] = []
-        self._states: dict = {}
+        # subscriptions indexed by the combination of filtered fields and their values:
+        # {field mask: (key function, {key: [subscriptions]})}, replaced on every change (copy-on-write)
+        self._subscriptions: dict[int, tuple[Callable, dict[object, list[AsbSubscription]]]] = {}
+        self._subscriptions_lock = threading.Lock()
+        self._subscription_seq = itertools.count()
+
+        # outstanding pings per target, oldest first
+        self._pings_pending: dict[int, deque[dict]] = {}
+        self._pings_lock = threading.Lock()
+        self._known_nodes: dict[int, AsbNode] = {}
+        self.states = states if states is not None else AsbStateStore()
+
+        # state responder: groups to answer (None = all known groups), open reply windows per group
+        # with a flag whether another request arrived in the window
+        self._responder_enabled = False
+        self._responder_groups: frozenset[int]|None = None
+        self._responder_window = STATE_REPLY_WINDOW_SEC
+        self._reply_windows: dict[int, bool] = {}
+        self._reply_lock = threading.Lock()
 
     def _callback(self, pkg: AsbPacket|None) -> None:
         """ Internal callback function for incoming ASB packages """
         if pkg is None:
+            if self._metrics:
+                self._metrics.inc("interface_rx_invalid")
             return
 
+        if self._metrics:
+            self._metrics.inc("interface_rx_packets")
         self._handle_subscribe_list(pkg)
-        self._handle_ping_timeout()
         self._handle_node_discovery(pkg)
-        self._handle_state(pkg)
+        self.states.update(pkg)
 
         # handle incoming packets with target = self
         if pkg.meta.mtype == AsbMessageType.ASB_PKGTYPE_UNICAST and pkg.meta.target == self._node_id:
             if pkg.data[0] == AsbCommand.ASB_CMD_PONG:
-                for i, source in enumerate(self._pings_pending):
-                    if source["target"] == pkg.meta.source:
-                        time_ms = round((time.time() - source["time"]) * 1000)
-                        source["cb"](True, time_ms)
-                        self._pings_pending.pop(i)
+                self._handle_pong(pkg)
+
+        # state requests and replies of groups answered by this interface
+        if self._responder_enabled and pkg.meta.mtype == AsbMessageType.ASB_PKGTYPE_MULTICAST and pkg.len >= 1:
+            if pkg.data[0] == AsbCommand.ASB_CMD_REQ and pkg.meta.source != self._node_id:
+                self._handle_state_request(pkg.meta.target)
+            elif pkg.data[0] in ASB_STATE_COMMANDS and pkg.meta.source != self._node_id:
+                self._handle_state_reply(pkg.meta.target)
 
         pass  # TODO: Handle incoming packets
 
     def _handle_subscribe_list(self, pkg: AsbPacket) -> None:
-        for sub in self._subscribe_list:
-            if (sub["mtype"] is None or sub["mtype"] == pkg.meta.mtype) and \
-               (sub["target"] is None or sub["target"] == pkg.meta.target) and \
-               (sub["port"] is None or sub["port"] == pkg.meta.port) and \
-               (sub["cmd"] is None or int(sub["cmd"]) == pkg.data[0]):
-                    sub["cb"](pkg)
-
-    def _handle_ping_timeout(self) -> None:
-        """ Internal function to detect when a ping times out """
-        for i, source in enumerate(self._pings_pending):
-            if (time.time() - source["time"]) > PING_TIMEOUT_SEC:
-                source["cb"](False, -1)
-                self._pings_pending.pop(i)
+        subscriptions = self._subscriptions
+        if not subscriptions:
+            return
+
+        meta = pkg.meta
+        values = (meta.mtype, meta.target, meta.port, pkg.data[0] if pkg.data else None)
+
+        matched: list[AsbSubscription] = []
+        buckets = 0
+        for key_of, index in subscriptions.values():
+            subs = index.get(key_of(values))
+            if subs:
+                matched += subs
+                buckets += 1
+
+        if buckets > 1:
+            matched.sort(key=lambda sub: sub.seq)  # call in order of subscription
+
+        if self._profile_callbacks:
+            for sub in matched:
+                self._call_profiled(sub, pkg)
+            return
+
+        for sub in matched:
+            try:
+                sub.callback(pkg)
+            except Exception:
+                logging.getLogger(__name__).exception("Subscription callback %r failed", sub.callback)
+
+    def _call_profiled(self, sub: AsbSubscription, pkg: AsbPacket) -> None:
+        """ Call a subscription callback and record its time """
+        metrics = self._metrics
+        start = time.perf_counter()
+        try:
+            sub.callback(pkg)
+        except Exception:
+            if metrics:
+                metrics.inc("callback_exceptions")
+            logging.getLogger(__name__).exception("Subscription callback %r failed", sub.callback)
+        elapsed = time.perf_counter() - start
+
+        # not locked, with several dispatcher workers a concurrent update may get lost
+        sub.calls += 1
+        sub.total_time += elapsed
+        if elapsed > sub.max_time:
+            sub.max_time = elapsed
+
+        if elapsed >= self._slow_callback_sec:
+            sub.slow_calls += 1
+            logging.getLogger(__name__).warning("Slow subscription callback %s took %.1f ms for %s",
+                                                sub.describe(), elapsed * 1000, pkg)
+
+        if metrics:
+            hist = self._callback_histograms.get(sub.seq)
+            if hist is None:
+                name = getattr(sub.callback, "__qualname__", repr(sub.callback))
+                hist = metrics.histogram("callback_seconds", {"callback": name})
+                self._callback_histograms[sub.seq] = hist
+            hist.observe(elapsed)
+
+    def _handle_pong(self, pkg: AsbPacket) -> None:
+        """ Internal function to complete the oldest outstanding ping to the source of a pong """
+        with self._pings_lock:
+            pending = self._pings_pending.get(pkg.meta.source)
+            if not pending:
+                return
+            ping = pending.popleft()
+            if not pending:
+                del self._pings_pending[pkg.meta.source]
+        ping["timer"].cancel()
+
+        time_ms = round((time.time() - ping["time"]) * 1000)
+        ping["cb"](True, time_ms)
+
+    def _handle_ping_timeout(self, ping: dict) -> None:
+        """ Internal function called by the scheduler when a ping times out """
+        with self._pings_lock:
+            pending = self._pings_pending.get(ping["target"])
+            if not pending or ping not in pending:
+                return  # answered in the meantime
+            pending.remove(ping)
+            if not pending:
+                del self._pings_pending[ping["target"]]
+
+        ping["cb"](False, -1)
+
+    def _handle_state_request(self, group: int) -> None:
+        """ Answer a state request, or mark it for the end of the reply window if the group was answered recently """
+        if self._responder_groups is not None and group not in self._responder_groups:
+            return
+
+        with self._reply_lock:
+            if group in self._reply_windows:
+                self._reply_windows[group] = True
+                return
+            self._reply_windows[group] = False
+
+        self._scheduler.call_later(self._responder_window, self._handle_reply_window_end, group)
+        self._send_state_reply(group)
+
+    def _handle_state_reply(self, group: int) -> None:
+        """ Another node sent the state of the group, so a pending reply is not needed any more """
+        with self._reply_lock:
+            if self._reply_windows.get(group):
+                self._reply_windows[group] = False
+
+    def _handle_reply_window_end(self, group: int) -> None:
+        """ Internal function called by the scheduler, sends the reply to requests received during the window """
+        with self._reply_lock:
+            pending = self._reply_windows.pop(group, False)
+            if pending:
+                self._reply_windows[group] = False  # the reply starts the next window
+
+        if pending:
+            self._scheduler.call_later(self._responder_window, self._handle_reply_window_end, group)
+            self._send_state_reply(group)
+
+    def _send_state_reply(self, group: int) -> bool:
+        state = self.states.get(group)
+        if state is None:
+            return False
+
+        if self._metrics:
+            self._metrics.inc("state_replies")
+        pkg = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, group, self._node_id), 2, [state.cmd, state.value])
+        return self._comm.send_packet(pkg)
 
     def _handle_node_discovery(self, pkg: AsbPacket) -> None:
         """ Handle node discovery packets, called from the callback function """
 
-        node = None
-        for n in self._known_nodes:
-            if n.id == pkg.meta.source:
-                node = n
-                break
-
+        node = self._known_nodes.get(pkg.meta.source)
         if not node:
             node = AsbNode(pkg.meta.source, -1, -1, -1, [])
-            self._known_nodes.append(node)
+            self._known_nodes[node.id] = node
             self.send_modules_request(pkg.meta.source)
 
         node.last_seen = int(time.time())
 
+        # per node statistics: rate = rate * e^(-dt/tau) + 1/tau converges to the packets per second
+        now = time.monotonic()
+        if node.rx_time >= 0:
+            node.rx_rate = node.rx_rate * math.exp((node.rx_time - now) / NODE_RATE_TAU_SEC) + 1 / NODE_RATE_TAU_SEC
+        else:
+            node.rx_rate = 1 / NODE_RATE_TAU_SEC
+        node.rx_time = now
+        node.rx_frames += 1
+
         # message: modules
         if pkg.meta.mtype == AsbMessageType.ASB_PKGTYPE_UNICAST and pkg.meta.target == self._node_id:
             if pkg.data[0] == AsbCommand.ASB_CMD_RES_MODULES:
-                io_mod = None
-                for m in node.io_modules:
-                    if m.cfg_id == pkg.data[1]:
-                        io_mod = m
-                        break
+                io_mod = node.io_module_index.get(pkg.data[1])
 
                 if not io_mod:
                     io_mod = AsbIoModule(
@@ -93,6 +317,7 @@ class AsbInterface:
                         target=-1
                     )
                     node.io_modules.append(io_mod)
+                    node.io_module_index[io_mod.cfg_id] = io_mod
                 else:
                     # update existing module
                     io_mod.mod_type = AsbIoModuleType(pkg.data[2]) if pkg.data[2] in AsbIoModuleType._value2member_map_ else None
@@ -106,16 +331,30 @@ class AsbInterface:
             elif pkg.data[0] == AsbCommand.ASB_CMD_HEARTBEAT:
                 node.reported_uptime_days = round(((pkg.data[1]<<24)+(pkg.data[2]<<32))/86400000)
 
-    def _handle_state(self, pkg: AsbPacket) -> None:
-        # handle multicast state changes
-        if pkg.meta.mtype == AsbMessageType.ASB_PKGTYPE_MULTICAST:
-            if pkg.data[0] in [AsbCommand.ASB_CMD_1B, AsbCommand.ASB_CMD_S_PER]:
-                self._states[(pkg.meta.mtype, pkg.meta.target, -1)] = {
-                    "type": int(pkg.data[0]),
-                    "value": pkg.data[1],
-                    "time": time.time(),
-                    "changed_by": pkg.meta.source
-                }
+    def stop(self) -> None:
+        """ Stop the timeout scheduler if it is owned by this interface """
+        if self._own_scheduler:
+            self._scheduler.stop()
+
+    def enable_state_responder(self, groups: Iterable[int]|None = None, window: float = STATE_REPLY_WINDOW_SEC) -> None:
+        """
+        Answer state requests (ASB_CMD_REQ) of other nodes with the last known value from states
+
+        The first request of a group is answered immediately. Further requests within the window are
+        answered once at its end, unless another node sent the state in the meantime, so a mass reboot
+        causes at most one reply per group and window. Groups with unknown state are not answered.
+
+        Parameters:
+            groups (Iterable[int]|None): The multicast groups to answer (None = all groups with known state)
+            window (float): Minimum time in seconds between two replies for the same group
+        """
+        self._responder_groups = frozenset(groups) if groups is not None else None
+        self._responder_window = window
+        self._responder_enabled = True
+
+    def disable_state_responder(self) -> None:
+        """ Stop answering state requests """
+        self._responder_enabled = False
 
     def get_nodes(self) -> list[AsbNode]:
         """
@@ -124,9 +363,40 @@ class AsbInterface:
         Returns:
             list[AsbNode]: A list of all known nodes
         """
-        return self._known_nodes
+        return list(self._known_nodes.values())
+
+    def get_node(self, node_id: int) -> AsbNode|None:
+        """
+        Get a known node by its ID
 
-    def subscribe(self, callback: Callable[[AsbPacket], None], mtype: AsbMessageType|None = None, target: int|None = None, port: int|None = None, cmd: AsbCommand|int|None = None) -> None:
+        Parameters:
+            node_id (int): The node ID
+
+        Returns:
+            AsbNode|None: The node or None if it is unknown
+        """
+        return self._known_nodes.get(node_id)
+
+    def get_busiest_nodes(self, count: int = 10) -> list[tuple[AsbNode, float]]:
+        """
+        Get the nodes sending the most packets
+
+        Parameters:
+            count (int): The maximum number of nodes to return
+
+        Returns:
+            list[tuple[AsbNode, float]]: The nodes and their current packets per second, highest rate first
+        """
+        now = time.monotonic()
+        rates = [
+            (node, node.rx_rate * math.exp((node.rx_time - now) / NODE_RATE_TAU_SEC))
+            for node in self._known_nodes.values() if node.rx_time >= 0
+        ]
+        rates.sort(key=lambda rate: rate[1], reverse=True)
+
+        return rates[:count]
+
+    def subscribe(self, callback: Callable[[AsbPacket], None], mtype: AsbMessageType|None = None, target: int|None = None, port: int|None = None, cmd: AsbCommand|int|None = None) -> AsbSubscription:
         """
         Subscribe to a specific message type
 
@@ -136,14 +406,94 @@ class AsbInterface:
             target (int|None): The target address to subscribe to (None = all targets)
             port (int|None): The port to subscribe to (None = all ports)
             cmd (AsbCommand|int|None): The command to subscribe to (None = all commands)
+
+        Returns:
+            AsbSubscription: Handle to pass to unsubscribe
         """
-        self._subscribe_list.append({
-            "mtype": mtype,
-            "target": target,
-            "port": port,
-            "cmd": cmd,
-            "cb": callback
-            })
+        sub = AsbSubscription(callback, mtype, target, port, int(cmd) if cmd is not None else None)
+
+        with self._subscriptions_lock:
+            sub.seq = next(self._subscription_seq)
+            mask, key = self._subscription_key(sub)
+
+            subscriptions = dict(self._subscriptions)
+            key_of, index = subscriptions.get(mask, (_SUBSCRIPTION_KEY_GETTERS[mask], {}))
+            index = dict(index)
+            index[key] = index.get(key, []) + [sub]
+            subscriptions[mask] = (key_of, index)
+            self._subscriptions = subscriptions
+
+        return sub
+
+    def unsubscribe(self, sub: AsbSubscription) -> bool:
+        """
+        Remove a subscription
+
+        Parameters:
+            sub (AsbSubscription): The handle returned by subscribe
+
+        Returns:
+            bool: True if the subscription was removed, False if it was not subscribed
+        """
+        with self._subscriptions_lock:
+            mask, key = self._subscription_key(sub)
+            if mask not in self._subscriptions:
+                return False
+            key_of, index = self._subscriptions[mask]
+            if sub not in index.get(key, []):
+                return False
+
+            subscriptions = dict(self._subscriptions)
+            index = dict(index)
+            index[key] = [s for s in index[key] if s is not sub]
+            if not index[key]:
+                del index[key]
+            if index:
+                subscriptions[mask] = (key_of, index)
+            else:
+                del subscriptions[mask]
+            self._subscriptions = subscriptions
+        self._callback_histograms.pop(sub.seq, None)
+
+        return True
+
+    def get_subscriptions(self) -> list[AsbSubscription]:
+        """
+        Get all subscriptions
+
+        Returns:
+            list[AsbSubscription]: The subscriptions in order of subscription
+        """
+        subs = [sub for _, index in self._subscriptions.values() for bucket in index.values() for sub in bucket]
+        subs.sort(key=operator.attrgetter("seq"))
+
+        return subs
+
+    def get_slowest_subscriptions(self, count: int = 10) -> list[AsbSubscription]:
+        """
+        Get the subscriptions whose callbacks took the most time (see profile_callbacks)
+
+        Parameters:
+            count (int): The maximum number of subscriptions to return
+
+        Returns:
+            list[AsbSubscription]: The subscriptions, highest total_time first
+        """
+        subs = [sub for sub in self.get_subscriptions() if sub.calls]
+        subs.sort(key=operator.attrgetter("total_time"), reverse=True)
+
+        return subs[:count]
+
+    @staticmethod
+    def _subscription_key(sub: AsbSubscription) -> tuple[int, object]:
+        """ Get the field mask and index key of a subscription """
+        values = (sub.mtype, sub.target, sub.port, sub.cmd)
+        mask = 0
+        for i, value in enumerate(values):
+            if value is not None:
+                mask |= 1 << i
+
+        return mask, _SUBSCRIPTION_KEY_GETTERS[mask](values)
 
     def asb_send_0bit(self, mtype: AsbMessageType, target: int, port: int) -> bool:
         """
@@ -251,25 +601,40 @@ class AsbInterface:
         self._callback(pkg)
         return self._comm.send_packet(pkg)
 
-    def asb_do_ping(self, target: int, callback: Callable[[bool, int], None]) -> bool:
+    def asb_do_ping(self, target: int, callback: Callable[[bool, int], None], timeout: float = PING_TIMEOUT_SEC) -> bool:
         """
         Send a ping to the target and wait for a pong
 
+        Several pings to the same target may be outstanding, each pong answers the oldest one.
+
         Parameters:
             target (int): The target address
-            callback (function): The callback function to call when the pong is received (bool: success, int: time in ms)
+            callback (function): The callback function to call when the pong is received or the ping timed out (bool: success, int: time in ms)
+            timeout (float): Time in seconds to wait for the pong
 
         Returns:
             bool: True if the target responded to the ping
         """
-        if not self.asb_send_ping(target):
-            return False
-
-        self._pings_pending.append({
+        ping = {
             "target": target,
             "time": time.time(),
             "cb": callback
-            })
+            }
+
+        # register before sending, the pong may arrive before asb_send_ping returns
+        with self._pings_lock:
+            self._pings_pending.setdefault(target, deque()).append(ping)
+            ping["timer"] = self._scheduler.call_later(timeout, self._handle_ping_timeout, ping)
+
+        if not self.asb_send_ping(target):
+            ping["timer"].cancel()
+            with self._pings_lock:
+                pending = self._pings_pending.get(target)
+                if pending and ping in pending:
+                    pending.remove(ping)
+                    if not pending:
+                        del self._pings_pending[target]
+            return False
 
         return True
 
@@ -289,10 +654,8 @@ class AsbInterface:
             return False
 
         # check if new ID is already in use
-        if not force:
-            for node in self._known_nodes:
-                if node.id == new_id:
-                    return False
+        if not force and new_id in self._known_nodes:
+            return False
 
         pkg = AsbPacket(
             AsbMeta(
@@ -309,10 +672,10 @@ class AsbInterface:
 
         if res > 0:
             # update node ID in known nodes
-            for node in self._known_nodes:
-                if node.id == target:
-                    node.id = new_id
-                    break
+            node = self._known_nodes.pop(target, None)
+            if node:
+                node.id = new_id
+                self._known_nodes[new_id] = node
 
         return res
 
@@ -0,0 +1,129 @@
+import asyncio
+
+from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_interface import AsbInterface, PING_TIMEOUT_SEC, SLOW_CALLBACK_SEC
+from asysbuslib.asb_metrics import AsbMetrics
+from asysbuslib.asb_node import AsbNode
+from asysbuslib.asb_proto import AsbMessageType, AsbCommand, AsbPacket
+from asysbuslib.asb_state import AsbStateStore
+
+
+# time to wait for the next module response before the list is considered complete
+MODULES_TIMEOUT_SEC = 1.0
+
+
+class AsyncAsbInterface(AsbInterface):
+    """
+    AsbInterface with awaitable requests
+
+    Timeouts run on the event loop, so the communication interface has to call its callbacks
+    from the same loop (e.g. AsbUartAsync).
+    """
+
+    def __init__(self, node_id: int, comm: AsbComm, loop: asyncio.AbstractEventLoop|None = None,
+                 metrics: AsbMetrics|None = None, profile_callbacks: bool = False,
+                 slow_callback_sec: float = SLOW_CALLBACK_SEC, states: AsbStateStore|None = None) -> None:
+        """
+        Initialize the ASB interface
+
+        Parameters:
+            node_id (int): The node ID of this interface on the bus
+            comm (AsbComm): The communication interface
+            loop (asyncio.AbstractEventLoop|None): The event loop (None = the running loop)
+            metrics (AsbMetrics|None): Record counters and latencies (None = disabled)
+            profile_callbacks (bool): Time the subscription callbacks
+            slow_callback_sec (float): Log callbacks taking at least this time in seconds
+            states (AsbStateStore|None): Store for the group states (None = new store)
+        """
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        super().__init__(node_id, comm, scheduler=self._loop, metrics=metrics,
+                         profile_callbacks=profile_callbacks, slow_callback_sec=slow_callback_sec,
+                         states=states)
+
+    async def ping(self, target: int, timeout: float = PING_TIMEOUT_SEC) -> int|None:
+        """
+        Ping the target
+
+        Parameters:
+            target (int): The target address
+            timeout (float): Time in seconds to wait for the pong
+
+        Returns:
+            int|None: The round trip time in ms or None if the target did not respond
+        """
+        fut = self._loop.create_future()
+
+        def done(success: bool, time_ms: int) -> None:
+            if not fut.done():
+                fut.set_result(time_ms if success else None)
+
+        if not self.asb_do_ping(target, done, timeout):
+            return None
+
+        return await fut
+
+    async def wait_packet(self, mtype: AsbMessageType|None = None, target: int|None = None, port: int|None = None, cmd: AsbCommand|int|None = None, source: int|None = None, timeout: float|None = None) -> AsbPacket|None:
+        """
+        Wait for the next packet matching the same criteria as subscribe
+
+        Parameters:
+            mtype (AsbMessageType|None): The message type (None = all types)
+            target (int|None): The target address (None = all targets)
+            port (int|None): The port (None = all ports)
+            cmd (AsbCommand|int|None): The command (None = all commands)
+            source (int|None): The source address (None = all sources)
+            timeout (float|None): Time in seconds to wait (None = forever)
+
+        Returns:
+            AsbPacket|None: The packet or None on timeout
+        """
+        fut = self._loop.create_future()
+
+        def received(pkg: AsbPacket) -> None:
+            if not fut.done() and (source is None or pkg.meta.source == source):
+                fut.set_result(pkg)
+
+        sub = self.subscribe(received, mtype, target, port, cmd)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.unsubscribe(sub)
+
+    async def request_modules(self, target: int, timeout: float = MODULES_TIMEOUT_SEC) -> AsbNode|None:
+        """
+        Request the I/O modules of the target and wait until it sent all of them
+
+        The node answers with one packet per module, the list is complete when no response
+        arrived for timeout seconds.
+
+        Parameters:
+            target (int): The target address
+            timeout (float): Time in seconds to wait for the next module
+
+        Returns:
+            AsbNode|None: The node with its modules or None if the target did not respond
+        """
+        responses = asyncio.Queue()
+
+        def received(pkg: AsbPacket) -> None:
+            if pkg.meta.source == target:
+                responses.put_nowait(pkg)
+
+        sub = self.subscribe(received, AsbMessageType.ASB_PKGTYPE_UNICAST, self._node_id, cmd=AsbCommand.ASB_CMD_RES_MODULES)
+        try:
+            if not self.send_modules_request(target):
+                return None
+
+            count = 0
+            while True:
+                try:
+                    await asyncio.wait_for(responses.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                count += 1
+        finally:
+            self.unsubscribe(sub)
+
+        return self.get_node(target) if count else None
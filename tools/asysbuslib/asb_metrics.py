@@ -0,0 +1,211 @@
+# Optional counters and latency histograms for AsbUart and AsbInterface, exported as Prometheus text or JSON
+
+from bisect import bisect_left
+
+import json
+import threading
+
+
+# upper bounds of the histogram buckets in seconds: 1 µs, 2 µs, 4 µs ... about 8 s
+ASB_METRICS_BUCKETS = tuple(0.000001 * 2 ** i for i in range(24))
+
+
+class AsbHistogram:
+    """
+    Histogram with fixed logarithmic buckets
+
+    Attributes:
+        counts (list[int]): Number of values per bucket of ASB_METRICS_BUCKETS, the last one counts larger values
+        count (int): Number of values
+        sum (float): Sum of the values
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(ASB_METRICS_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """
+        Add a value
+
+        Parameters:
+            value (float): The value (e.g. a duration in seconds)
+        """
+        i = bisect_left(ASB_METRICS_BUCKETS, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile from the buckets
+
+        Parameters:
+            q (float): The quantile (0-1, e.g. 0.99)
+
+        Returns:
+            float: Upper bound of the bucket containing the quantile, inf if it is above the largest bucket
+        """
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return ASB_METRICS_BUCKETS[i] if i < len(ASB_METRICS_BUCKETS) else float("inf")
+        return 0.0
+
+
+class AsbMetrics:
+    """
+    Collection of named counters and histograms
+
+    Pass an instance to AsbUart or AsbInterface to enable their instrumentation, without
+    one they only check for None per chunk or packet. Names and labels are used as given,
+    the export adds the prefix.
+    """
+
+    def __init__(self, prefix: str = "asb_") -> None:
+        """
+        Initialize the metrics
+
+        Parameters:
+            prefix (str): Prefix of all metric names in the export
+        """
+        self.prefix = prefix
+        self._counters: dict[tuple[str, tuple], int] = {}
+        self._histograms: dict[tuple[str, tuple], AsbHistogram] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: int = 1, labels: dict[str, str]|None = None) -> None:
+        """
+        Increase a counter
+
+        Parameters:
+            name (str): Name of the counter
+            value (int): Amount to add
+            labels (dict[str, str]|None): Labels of the counter
+        """
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def histogram(self, name: str, labels: dict[str, str]|None = None) -> AsbHistogram:
+        """
+        Get a histogram, it is created on first use
+
+        Parameters:
+            name (str): Name of the histogram
+            labels (dict[str, str]|None): Labels of the histogram
+
+        Returns:
+            AsbHistogram: The histogram
+        """
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, AsbHistogram())
+        return hist
+
+    def observe(self, name: str, value: float, labels: dict[str, str]|None = None) -> None:
+        """
+        Add a value to a histogram
+
+        Parameters:
+            name (str): Name of the histogram
+            value (float): The value (e.g. a duration in seconds)
+            labels (dict[str, str]|None): Labels of the histogram
+        """
+        self.histogram(name, labels).observe(value)
+
+    def get(self, name: str, labels: dict[str, str]|None = None) -> int:
+        """
+        Get the value of a counter
+
+        Parameters:
+            name (str): Name of the counter
+            labels (dict[str, str]|None): Labels of the counter
+
+        Returns:
+            int: The value, 0 if it was never increased
+        """
+        return self._counters.get((name, tuple(sorted(labels.items())) if labels else ()), 0)
+
+    @staticmethod
+    def _labels(labels: tuple, le: str|None = None) -> str:
+        if le is not None:
+            labels = labels + (("le", le),)
+        if not labels:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+    def to_prometheus(self) -> str:
+        """
+        Export all metrics in the Prometheus text format
+
+        Returns:
+            str: The metrics
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        typed = set()
+        for (name, labels), value in counters:
+            full = self.prefix + name
+            if full not in typed:
+                lines.append(f"# TYPE {full} counter")
+                typed.add(full)
+            lines.append(f"{full}{self._labels(labels)} {value}")
+
+        for (name, labels), hist in histograms:
+            full = self.prefix + name
+            if full not in typed:
+                lines.append(f"# TYPE {full} histogram")
+                typed.add(full)
+            cumulative = 0
+            for bound, count in zip(ASB_METRICS_BUCKETS, hist.counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{self._labels(labels, format(bound, 'g'))} {cumulative}")
+            lines.append(f"{full}_bucket{self._labels(labels, '+Inf')} {hist.count}")
+            lines.append(f"{full}_sum{self._labels(labels)} {hist.sum:g}")
+            lines.append(f"{full}_count{self._labels(labels)} {hist.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        """
+        Get all metrics as dictionary, e.g. for logging
+
+        Returns:
+            dict: Counters (name, labels, value) and histograms (name, labels, count, sum, p50, p99, None = above the largest bucket)
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+
+        def finite(value: float) -> float|None:
+            return value if value != float("inf") else None
+
+        return {
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters],
+            "histograms": [
+                {"name": name, "labels": dict(labels), "count": hist.count, "sum": hist.sum,
+                 "p50": finite(hist.quantile(0.5)), "p99": finite(hist.quantile(0.99))}
+                for (name, labels), hist in histograms
+            ]
+        }
+
+    def to_json(self) -> str:
+        """
+        Export all metrics as JSON
+
+        Returns:
+            str: The metrics (see to_dict)
+        """
+        return json.dumps(self.to_dict())
@@ -0,0 +1,514 @@
+# Relaying multicast group states between the bus and MQTT topics, as used by tools/mqtt-proxy.py
+#
+# <base>/<group>/get/switch  state of a group (ASB_CMD_1B), published by the proxy
+# <base>/<group>/get/level   state of a group (ASB_CMD_PER), published by the proxy
+# <base>/<group>/set/switch  set a group (ASB_CMD_1B), subscribed by the proxy
+# <base>/<group>/set/level   set a group (ASB_CMD_PER), subscribed by the proxy
+# <base>/<node>/lastboot     UNIX timestamp of the last boot message of a node
+#
+# group and node are 4 digit lower case hex numbers
+
+from typing import Awaitable, Callable, Hashable
+
+import asyncio
+import logging
+import threading
+import time
+
+from asysbuslib.asb_interface import AsbInterface, AsbSubscription
+from asysbuslib.asb_metrics import AsbMetrics
+from asysbuslib.asb_proto import AsbMessageType, AsbCommand, AsbPacket
+
+
+# topic name and value range per command
+ASB_MQTT_COMMANDS = {
+    AsbCommand.ASB_CMD_1B: ("switch", 1),
+    AsbCommand.ASB_CMD_PER: ("level", 100),
+}
+
+# payloads of all byte values, so publishing does not format numbers
+_PAYLOADS = tuple(str(value).encode() for value in range(256))
+
+# marks a coalescing window without pending value
+_NOTHING = object()
+
+# default number of messages published without acknowledgement
+ASB_MQTT_INFLIGHT = 32
+
+
+class AsbMqttTopicIndex:
+    """
+    Bidirectional index between topics and (group, command)
+
+    Topics are built and parsed once per group and command and then looked up in dictionaries,
+    so the message path only does a dictionary lookup per direction.
+    """
+
+    def __init__(self, base: str = "/asysbus", groups: range|list[int]|None = None) -> None:
+        """
+        Initialize the index
+
+        Parameters:
+            base (str): Topic prefix without trailing slash
+            groups (range|list[int]|None): Groups to add in advance, others are added on first use
+        """
+        self.base = base
+        self._state_topics: dict[tuple[int, int], str] = {}
+        self._set_topics: dict[str, tuple[int, int]] = {}
+        self._boot_topics: dict[int, str] = {}
+
+        for group in groups or []:
+            self._add_group(group)
+
+    def _add_group(self, group: int) -> None:
+        for cmd, (name, _) in ASB_MQTT_COMMANDS.items():
+            self._state_topics[(group, cmd)] = f"{self.base}/{group:04x}/get/{name}"
+            self._set_topics[f"{self.base}/{group:04x}/set/{name}"] = (group, cmd)
+
+    @property
+    def set_filter(self) -> str:
+        """ Topic filter for subscribing to all set topics """
+        return f"{self.base}/+/set/#"
+
+    @property
+    def lwt_topic(self) -> str:
+        """ Topic of the last will (ON/OFF) """
+        return f"{self.base}/LWT"
+
+    def state_topic(self, group: int, cmd: int) -> str|None:
+        """
+        Get the topic for publishing the state of a group
+
+        Parameters:
+            group (int): The multicast group (0x0001-0xFFFF)
+            cmd (int): The command (ASB_CMD_1B or ASB_CMD_PER)
+
+        Returns:
+            str|None: The topic or None if the command has no topic
+        """
+        topic = self._state_topics.get((group, cmd))
+        if topic is None and cmd in ASB_MQTT_COMMANDS and 0 < group <= 0xFFFF:
+            self._add_group(group)
+            topic = self._state_topics[(group, cmd)]
+        return topic
+
+    def boot_topic(self, node: int) -> str:
+        """
+        Get the topic for publishing the boot time of a node
+
+        Parameters:
+            node (int): The node ID
+
+        Returns:
+            str: The topic
+        """
+        topic = self._boot_topics.get(node)
+        if topic is None:
+            topic = self._boot_topics[node] = f"{self.base}/{node:04x}/lastboot"
+        return topic
+
+    def parse_set_topic(self, topic: str) -> tuple[int, int]|None:
+        """
+        Get the group and command of a set topic
+
+        Parameters:
+            topic (str): The topic
+
+        Returns:
+            tuple[int, int]|None: The group and command or None if it is no valid set topic
+        """
+        target = self._set_topics.get(topic)
+        if target is not None:
+            return target
+
+        # unknown group: parse once, later messages hit the dictionary
+        prefix = self.base + "/"
+        if not topic.startswith(prefix):
+            return None
+        parts = topic[len(prefix):].split("/")
+        if len(parts) != 3 or parts[1] != "set":
+            return None
+        try:
+            group = int(parts[0], 16)
+        except ValueError:
+            return None
+        if group < 0x0001 or group > 0xFFFF:
+            return None
+
+        for cmd, (name, _) in ASB_MQTT_COMMANDS.items():
+            if name == parts[2]:
+                self._add_group(group)
+                self._set_topics[topic] = (group, cmd)  # also other spellings, e.g. upper case hex
+                return group, cmd
+        return None
+
+    @staticmethod
+    def payload(value: int) -> bytes:
+        """
+        Get the payload for publishing a value
+
+        Parameters:
+            value (int): The value (0-255)
+
+        Returns:
+            bytes: The payload
+        """
+        return _PAYLOADS[value]
+
+    @staticmethod
+    def parse_value(cmd: int, payload: bytes) -> int|None:
+        """
+        Get the value of a set message
+
+        Parameters:
+            cmd (int): The command of the topic
+            payload (bytes): The payload (decimal number)
+
+        Returns:
+            int|None: The value or None if it is invalid or out of range for the command
+        """
+        try:
+            value = int(payload)
+        except ValueError:
+            return None
+        if value < 0 or value > ASB_MQTT_COMMANDS[cmd][1]:
+            return None
+        return value
+
+
+class AsbCoalescer:
+    """
+    Limits how often a value is sent per key, keeping only the newest value (last writer wins)
+
+    The first value of a key is sent immediately. Values submitted within the interval after a send
+    replace each other and only the newest one is sent when the interval ends.
+    """
+
+    def __init__(self, scheduler, interval: float, send: Callable[[Hashable, object], None]) -> None:
+        """
+        Initialize the coalescer
+
+        Parameters:
+            scheduler (AsbTimerScheduler|asyncio.AbstractEventLoop): Runs the delayed sends (call_later)
+            interval (float): Minimum time in seconds between two sends of the same key
+            send (function): Called with key and value to send a value
+        """
+        self.interval = interval
+        self.coalesced = 0
+
+        self._scheduler = scheduler
+        self._send = send
+        # {key: [pending value or _NOTHING, timer]} for keys sent within the interval
+        self._windows: dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, value: object) -> bool:
+        """
+        Send a value now or when the interval of the key ends
+
+        Parameters:
+            key (Hashable): The key, e.g. (group, command)
+            value (object): The value
+
+        Returns:
+            bool: True if the value was sent immediately
+        """
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None:
+                if window[0] is not _NOTHING:
+                    self.coalesced += 1  # replaced before it was sent
+                window[0] = value
+                return False
+            self._windows[key] = [_NOTHING, self._scheduler.call_later(self.interval, self._handle_window_end, key)]
+
+        self._send(key, value)
+        return True
+
+    def _handle_window_end(self, key: Hashable) -> None:
+        with self._lock:
+            window = self._windows.pop(key, None)
+            if window is None or window[0] is _NOTHING:
+                return
+            value = window[0]
+            self._windows[key] = [_NOTHING, self._scheduler.call_later(self.interval, self._handle_window_end, key)]
+
+        self._send(key, value)
+
+    def stop(self) -> None:
+        """ Cancel the pending sends """
+        with self._lock:
+            for _, timer in self._windows.values():
+                timer.cancel()
+            self._windows.clear()
+
+
+class AsbMqttBridge:
+    """
+    Relays group states between an AsbInterface and MQTT
+
+    The bridge does not depend on an MQTT client: received MQTT messages are passed to handle_message
+    and messages to publish are passed to the publish function, which should only queue them.
+
+    With min_interval set messages for the same group and command are coalesced (see AsbCoalescer),
+    so e.g. a dimmer slider sends at most one packet per interval with its newest value.
+    A state is only published when it differs from the last published value of the topic, so the
+    interface passing our own packets back and nodes repeating a value do not cause extra messages.
+    Set messages are always sent, the published value may be outdated (e.g. after a node restarted
+    in its default state). A boot message clears the published values, so the next states are
+    published again. If the publish function skips unchanged retained messages itself (AsbMqttPublisher),
+    pass its forget_retained as forget, so both forget the published values together.
+
+    Attributes:
+        bus_messages (int): Number of messages relayed from the bus to MQTT
+        mqtt_messages (int): Number of messages relayed from MQTT to the bus
+        invalid_messages (int): Number of MQTT messages with invalid topic or payload
+        suppressed_messages (int): Number of states not published because the value did not change
+    """
+
+    def __init__(self, interface: AsbInterface, publish: Callable[[str, bytes, bool], None],
+                 topics: AsbMqttTopicIndex|None = None, min_interval: float = 0.0, scheduler=None,
+                 forget: Callable[[], None]|None = None) -> None:
+        """
+        Initialize the bridge and subscribe to the group states on the interface
+
+        Parameters:
+            interface (AsbInterface): The ASB interface
+            publish (function): Called with topic, payload and retain flag for every message to publish
+            topics (AsbMqttTopicIndex|None): The topic index (None = default topics)
+            min_interval (float): Minimum time in seconds between two packets for the same group and command (0 = no limit)
+            scheduler (AsbTimerScheduler|asyncio.AbstractEventLoop|None): Runs the coalesced sends, required with min_interval
+            forget (function|None): Called when the published values are cleared (e.g. AsbMqttPublisher.forget_retained)
+        """
+        self.topics = topics if topics is not None else AsbMqttTopicIndex()
+        self.bus_messages = 0
+        self.mqtt_messages = 0
+        self.invalid_messages = 0
+        self.suppressed_messages = 0
+
+        self._interface = interface
+        self._publish = publish
+        self._forget = forget
+        self._published: dict[tuple[int, int], int] = {}  # last published value per (group, command)
+
+        self.coalescer: AsbCoalescer|None = None
+        if min_interval > 0:
+            if scheduler is None:
+                raise ValueError("min_interval needs a scheduler")
+            self.coalescer = AsbCoalescer(scheduler, min_interval, self._send)
+        self._subscriptions: list[AsbSubscription] = [
+            interface.subscribe(self._handle_state, AsbMessageType.ASB_PKGTYPE_MULTICAST, cmd=cmd)
+            for cmd in ASB_MQTT_COMMANDS
+        ]
+        self._subscriptions.append(
+            interface.subscribe(self._handle_boot, AsbMessageType.ASB_PKGTYPE_BROADCAST, cmd=AsbCommand.ASB_CMD_BOOT))
+
+    def stop(self) -> None:
+        """ Remove the subscriptions from the interface and drop coalesced messages """
+        for sub in self._subscriptions:
+            self._interface.unsubscribe(sub)
+        self._subscriptions = []
+        if self.coalescer:
+            self.coalescer.stop()
+
+    def _handle_state(self, pkg: AsbPacket) -> None:
+        if pkg.len < 2:
+            return
+        key = (pkg.meta.target, pkg.data[0])
+        topic = self.topics.state_topic(*key)
+        if topic is None:
+            return
+
+        value = pkg.data[1]
+        if self._published.get(key) == value:
+            self.suppressed_messages += 1
+            return
+        self._published[key] = value
+
+        self.bus_messages += 1
+        self._publish(topic, _PAYLOADS[value], True)
+
+    def republish(self) -> int:
+        """
+        Publish the known states of all groups again, e.g. after reconnecting to a broker without persistence
+
+        The states are taken from the state store of the interface.
+
+        Returns:
+            int: The number of published states
+        """
+        self._forget_published()
+        count = 0
+        for state in self._interface.states.get_all():
+            topic = self.topics.state_topic(state.group, state.cmd)
+            if topic is None:
+                continue
+            self._published[(state.group, state.cmd)] = state.value
+            self._publish(topic, _PAYLOADS[state.value], True)
+            count += 1
+
+        return count
+
+    def _forget_published(self) -> None:
+        self._published.clear()
+        if self._forget:
+            self._forget()
+
+    def _handle_boot(self, pkg: AsbPacket) -> None:
+        # the groups of the node are unknown, so forget all
+        self._forget_published()
+        self.bus_messages += 1
+        self._publish(self.topics.boot_topic(pkg.meta.source), str(time.time()).encode(), False)
+
+    def handle_message(self, topic: str, payload: bytes) -> bool:
+        """
+        Send the value of a set message to the bus
+
+        The interface passes sent packets to its subscriptions, so the new state is also published.
+        With min_interval the packet may be sent later, the result is True then.
+
+        Parameters:
+            topic (str): The topic of the message
+            payload (bytes): The payload of the message
+
+        Returns:
+            bool: True if the packet was sent, False if the message is invalid or sending failed
+        """
+        target = self.topics.parse_set_topic(topic)
+        value = self.topics.parse_value(target[1], payload) if target is not None else None
+        if value is None:
+            self.invalid_messages += 1
+            return False
+
+        self.mqtt_messages += 1
+        if self.coalescer:
+            self.coalescer.submit(target, value)
+            return True
+        return self._send(target, value)
+
+    def _send(self, key: tuple[int, int], value: int) -> bool:
+        group, cmd = key
+        if cmd == AsbCommand.ASB_CMD_1B:
+            return self._interface.asb_send_1bit(AsbMessageType.ASB_PKGTYPE_MULTICAST, group, -1, bool(value))
+        return self._interface.asb_send_percent(AsbMessageType.ASB_PKGTYPE_MULTICAST, group, -1, value)
+
+
+class AsbMqttPublisher:
+    """
+    Publishes queued messages with up to window messages waiting for the broker at the same time
+
+    Retained messages with the same payload as the last retained message of the topic are skipped,
+    the broker already has them. Call put from the event loop (e.g. as publish function of AsbMqttBridge)
+    and run the run coroutine as task.
+
+    Attributes:
+        published (int): Number of acknowledged messages
+        failed (int): Number of messages whose publish function raised
+        skipped (int): Number of retained messages skipped as unchanged
+        in_flight (int): Number of messages waiting for the broker
+        max_in_flight (int): Highest number of messages waiting for the broker
+        latency_sum (float): Sum of the times in seconds from put until acknowledgement
+        latency_max (float): Longest of these times
+    """
+
+    def __init__(self, publish: Callable[[str, bytes, bool], Awaitable[None]], window: int = ASB_MQTT_INFLIGHT,
+                 metrics: AsbMetrics|None = None) -> None:
+        """
+        Initialize the publisher
+
+        Parameters:
+            publish (function): Coroutine function publishing topic, payload and retain flag, returns when the
+                                broker acknowledged; it has to send before its first await, so the order is kept
+            window (int): Maximum number of messages waiting for the broker (1 = wait for every message)
+            metrics (AsbMetrics|None): Also record the counters and a latency histogram (None = disabled)
+        """
+        self.window = window
+        self.published = 0
+        self.failed = 0
+        self.skipped = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+        self._publish = publish
+        self._metrics = metrics
+        self._queue: asyncio.Queue[tuple[str, bytes, bool, float]] = asyncio.Queue()
+        self._retained: dict[str, bytes] = {}
+        self._slots = asyncio.Semaphore(window)
+        self._tasks: set[asyncio.Task] = set()
+
+    def put(self, topic: str, payload: bytes, retain: bool = False) -> bool:
+        """
+        Queue a message
+
+        Parameters:
+            topic (str): The topic
+            payload (bytes): The payload
+            retain (bool): Publish as retained message
+
+        Returns:
+            bool: False if the message was skipped as unchanged retained message
+        """
+        if retain:
+            if self._retained.get(topic) == payload:
+                self.skipped += 1
+                if self._metrics:
+                    self._metrics.inc("mqtt_skipped")
+                return False
+            self._retained[topic] = payload
+
+        self._queue.put_nowait((topic, payload, retain, time.perf_counter()))
+        return True
+
+    def forget_retained(self) -> None:
+        """
+        Forget the published retained messages, so they are not skipped when put again
+
+        Pass it to AsbMqttBridge as forget, the bridge calls it on boot messages and in republish.
+        """
+        self._retained.clear()
+
+    async def run(self) -> None:
+        """ Publish the queued messages until cancelled """
+        while True:
+            message = await self._queue.get()
+            await self._slots.acquire()
+            task = asyncio.ensure_future(self._publish_one(*message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """ Wait until all queued messages are acknowledged """
+        while not self._queue.empty() or self._tasks:
+            if self._tasks:
+                await asyncio.wait(list(self._tasks))
+            else:
+                await asyncio.sleep(0)
+
+    async def _publish_one(self, topic: str, payload: bytes, retain: bool, queued: float) -> None:
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+        try:
+            await self._publish(topic, payload, retain)
+        except Exception:
+            self.failed += 1
+            if retain and self._retained.get(topic) == payload:
+                del self._retained[topic]  # publish it again next time
+            logging.getLogger(__name__).exception("MQTT publish of %s failed", topic)
+            if self._metrics:
+                self._metrics.inc("mqtt_publish_failed")
+            return
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+        latency = time.perf_counter() - queued
+        self.published += 1
+        self.latency_sum += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+        if self._metrics:
+            self._metrics.inc("mqtt_published")
+            self._metrics.observe("mqtt_publish_seconds", latency)
@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 
 
@@ -39,6 +39,10 @@ class AsbNode:
         last_seen (int): UNIX timestamp of the last message received from the node or -1
         reported_uptime_days (int): Uptime in days reported by the node or -1
         io_modules (list[AsbIoModule]): List of ASB I/O modules of the node
+        io_module_index (dict[int, AsbIoModule]): The ASB I/O modules of the node by config ID
+        rx_frames (int): Number of packets received from the node
+        rx_rate (float): Exponentially weighted average of the packets per second at the time of the last packet
+        rx_time (float): Monotonic timestamp of the last packet received from the node or -1
     """
     id: int
 
@@ -47,3 +51,8 @@ class AsbNode:
     reported_uptime_days: int
 
     io_modules: list[AsbIoModule]
+    io_module_index: dict[int, AsbIoModule] = field(default_factory=dict, repr=False)
+
+    rx_frames: int = 0
+    rx_rate: float = 0.0
+    rx_time: float = -1
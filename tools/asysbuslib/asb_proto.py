@@ -3,6 +3,7 @@
 
 from dataclasses import dataclass
 from enum import IntEnum
+from typing import NamedTuple
 
 
 class AsbMessageType(IntEnum):
@@ -60,7 +61,7 @@ class AsbMeta:
     Attributes:
         type (int): Message Type (0 -> Broadcast, 1 -> Multicast, 2 -> Unicast)
         port (int): Port (0x00 - 0x1F, only used in Unicast Mode, otherwise -1)
-        target (int): Target address (Unicast: 0x0001 - 0x07FF, Multicast/Broadcast: 0x0001 - 0xFFFF, 0x0000 = invalid packet)
+        target (int): Target address (Unicast: 0x0001 - 0x07FF, Multicast/Broadcast: 0x0001 - 0xFFFF, Broadcast also 0x0000 (boot, heartbeat), otherwise 0x0000 = invalid packet)
         source (int): Source address (0x0001 - 0x07FF, 0x0000 = invalid packet)
     """
 
@@ -85,3 +86,52 @@ class AsbPacket:
     meta: AsbMeta
     len: int
     data: list[int]
+
+
+class AsbCompactPacket(NamedTuple):
+    """
+    Compact, immutable and hashable representation of a packet
+    Intended for logging and replaying large amounts of packets (one tuple plus the payload bytes
+    instead of AsbPacket, AsbMeta and a list)
+
+    Attributes:
+        mtype (AsbMessageType): Message Type
+        port (int): Port (only used in Unicast Mode, otherwise -1)
+        target (int): Target address
+        source (int): Source address
+        data (bytes): Payload
+    """
+
+    mtype: AsbMessageType
+    port: int
+    target: int
+    source: int
+    data: bytes
+
+    @property
+    def len(self) -> int:
+        """ Length of the payload in bytes """
+        return len(self.data)
+
+    @classmethod
+    def from_packet(cls, pkg: AsbPacket) -> "AsbCompactPacket":
+        """
+        Create a compact packet from an AsbPacket
+
+        Parameters:
+            pkg (AsbPacket): The packet to convert (payload values have to be in range 0-255)
+
+        Returns:
+            AsbCompactPacket: The compact packet
+        """
+        meta = pkg.meta
+        return cls(meta.mtype, meta.port, meta.target, meta.source, bytes(pkg.data))
+
+    def to_packet(self) -> AsbPacket:
+        """
+        Convert to an AsbPacket, e.g. to pass it to AsbInterface callbacks
+
+        Returns:
+            AsbPacket: The packet
+        """
+        return AsbPacket(AsbMeta(self.mtype, self.port, self.target, self.source), len(self.data), list(self.data))
@@ -0,0 +1,142 @@
+# Replay of captured bus traffic (see asb_capture.py) as communication interface, e.g. to load test subscriptions
+
+from typing import Callable
+
+import threading
+import time
+
+from asysbuslib.asb_capture import AsbCaptureReader, ASB_CAPTURE_TX
+from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_proto import AsbPacket
+
+
+class AsbReplayComm(AsbComm):
+    """
+    Communication interface that delivers the packets of capture files to the callbacks
+
+    With speed 1 the packets are delivered with the recorded timing, with speed 10 ten times faster
+    and with speed 0 as fast as the callbacks allow. Sent packets are counted and discarded.
+    Callbacks are called from the replay thread started by start.
+
+    Attributes:
+        frames (int): Number of delivered packets
+        sent (int): Number of packets passed to send_packet
+        elapsed (float): Time in seconds from start until the last delivered packet
+        callback_time_sum (float): Sum of the time in seconds spent in the callbacks
+        callback_time_max (float): Longest time for one packet
+        lag_sum (float): Sum of the delays in seconds behind the scaled recorded time (not counted with speed 0)
+        lag_max (float): Longest of these delays
+    """
+
+    def __init__(self, paths: str|list[str], speed: float = 1.0, include_tx: bool = False) -> None:
+        """
+        Initialize the replay
+
+        Parameters:
+            paths (str|list[str]): The capture file or the files in chronological order (see asb_capture_files)
+            speed (float): Replay speed relative to the recording (0 = as fast as possible)
+            include_tx (bool): Also deliver the packets that were sent by the recording program
+        """
+        if speed < 0:
+            raise ValueError("speed must be >= 0")
+
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.speed = speed
+        self.include_tx = include_tx
+
+        self.frames = 0
+        self.sent = 0
+        self.elapsed = 0.0
+        self.callback_time_sum = 0.0
+        self.callback_time_max = 0.0
+        self.lag_sum = 0.0
+        self.lag_max = 0.0
+
+        self._callbacks: list[Callable[[AsbPacket|None], None]] = []
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread|None = None
+        self._done = threading.Event()
+
+    @property
+    def frames_per_sec(self) -> float:
+        """ Achieved number of delivered packets per second """
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    def start(self) -> None:
+        """ Start the replay thread """
+        self._stop_event.clear()
+        self._done.clear()
+        self._thread = threading.Thread(target=self._run, name="AsbReplayComm", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float|None = None) -> bool:
+        """
+        Wait until all packets are delivered
+
+        Parameters:
+            timeout (float|None): Maximum time to wait in seconds (None = no limit)
+
+        Returns:
+            bool: True if the replay is finished
+        """
+        return self._done.wait(timeout)
+
+    def stop(self) -> None:
+        """ Stop the replay, also while waiting for the next packet """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        callbacks = self._callbacks
+        speed = self.speed
+        perf_counter = time.perf_counter
+        start = perf_counter()
+        stop_event = self._stop_event
+        recorded = 0.0  # recorded time since the first packet in seconds, gaps between files count as 0
+
+        try:
+            for path in self.paths:
+                # every file is a session of its own (see AsbCaptureWriter), the time until the next one is skipped
+                last_timestamp = None
+                with AsbCaptureReader(path) as reader:
+                    for timestamp, pkg, flags in reader.packets():
+                        if stop_event.is_set():
+                            return
+                        if flags & ASB_CAPTURE_TX and not self.include_tx:
+                            continue
+
+                        if last_timestamp is not None and timestamp > last_timestamp:
+                            recorded += (timestamp - last_timestamp) / 1e9
+                        last_timestamp = timestamp
+
+                        if speed > 0:
+                            due = start + recorded / speed
+                            delay = due - perf_counter()
+                            if delay > 0:
+                                if stop_event.wait(delay):
+                                    return
+                            else:
+                                self.lag_sum -= delay
+                                if -delay > self.lag_max:
+                                    self.lag_max = -delay
+
+                        begin = perf_counter()
+                        for callback in callbacks:
+                            callback(pkg)
+                        end = perf_counter()
+
+                        self.frames += 1
+                        self.callback_time_sum += end - begin
+                        if end - begin > self.callback_time_max:
+                            self.callback_time_max = end - begin
+                        self.elapsed = end - start
+        finally:
+            self._done.set()
+
+    def register_callback(self, callback: Callable[[AsbPacket|None], None]) -> None:
+        self._callbacks.append(callback)
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        self.sent += 1
+        return True
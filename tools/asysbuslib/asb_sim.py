@@ -0,0 +1,287 @@
+# In-process simulation of an ASB bus with virtual nodes, e.g. to test and benchmark AsbInterface without hardware
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+import random
+import threading
+import time
+
+from asysbuslib.asb_binary import AsbBinaryStreamDecoder, asb_binary_encode
+from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_endecode import asb_pkg_encode_bytes
+from asysbuslib.asb_node import AsbIoModuleType
+from asysbuslib.asb_proto import AsbMessageType, AsbCommand, AsbMeta, AsbPacket
+from asysbuslib.asb_stream import AsbStreamDecoder
+from asysbuslib.asb_timer import AsbTimerScheduler
+
+
+# the firmware sends boot and heartbeat messages to 0x0000 (see src/asb.cpp)
+ASB_SIM_BROADCAST_TARGET = 0x0000
+
+
+class AsbLoopbackBus:
+    """
+    A simulated bus connecting any number of AsbSimComm interfaces
+
+    Sent packets are queued and delivered to all other interfaces from the bus thread,
+    like a CAN bus a sender does not receive its own packets. Interfaces of simulated nodes
+    only receive unicast packets to their node ID (like the acceptance filter of a CAN controller),
+    so the number of nodes does not slow down the delivery of other packets. Optionally every packet is
+    encoded and decoded with a UART codec on the way, so the codec cost is part of the measurement.
+    The timers of the simulated nodes run on the scheduler of the bus.
+
+    Attributes:
+        frames (int): Number of packets sent on the bus
+        delivered (int): Number of packets delivered to all receivers
+        latency_sum (float): Sum of the time in seconds from sending until all receivers handled the packet
+        latency_max (float): Highest of these times
+    """
+
+    def __init__(self, codec: str|None = None) -> None:
+        """
+        Initialize the bus and start the bus thread
+
+        Parameters:
+            codec (str|None): Encode and decode every packet with "ascii" or "binary" framing, None = pass the packets
+        """
+        if codec not in (None, "ascii", "binary"):
+            raise ValueError("codec must be None, 'ascii' or 'binary'")
+
+        self._comms: list["AsbSimComm"] = []
+        self._node_comms: dict[int, "AsbSimComm"] = {}
+        self._queue: deque[tuple[float, "AsbSimComm", AsbPacket|bytes]] = deque()
+        self._cond = threading.Condition()
+        self._running = True
+
+        self._encode = None
+        self._decoder = None
+        if codec == "ascii":
+            self._encode, self._decoder = asb_pkg_encode_bytes, AsbStreamDecoder()
+        elif codec == "binary":
+            self._encode, self._decoder = asb_binary_encode, AsbBinaryStreamDecoder()
+
+        self.scheduler = AsbTimerScheduler()
+
+        self.frames = 0
+        self.delivered = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="AsbLoopbackBus", daemon=True)
+        self._thread.start()
+
+    def attach(self, comm: "AsbSimComm") -> None:
+        """ Connect an interface to the bus, called by AsbSimComm """
+        with self._cond:
+            if comm.node_id is None:
+                self._comms = self._comms + [comm]
+            else:
+                self._node_comms = {**self._node_comms, comm.node_id: comm}
+
+    def reset_stats(self) -> None:
+        """ Reset the counters, e.g. after a warm up """
+        self.frames = 0
+        self.delivered = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def send(self, sender: "AsbSimComm", pkg: AsbPacket) -> bool:
+        """
+        Queue a packet for delivery
+
+        Parameters:
+            sender (AsbSimComm): The sending interface
+            pkg (AsbPacket): The packet
+
+        Returns:
+            bool: False if the packet is invalid or the bus is stopped
+        """
+        if self._encode:
+            pkg = self._encode(pkg)
+        if not pkg or not self._running:
+            return False
+
+        with self._cond:
+            self._queue.append((time.perf_counter(), sender, pkg))
+            self.frames += 1
+            self._cond.notify()
+        return True
+
+    def stop(self) -> None:
+        """ Stop the node timers and the bus thread, queued packets are discarded """
+        self.scheduler.stop()
+        with self._cond:
+            self._running = False
+            self._queue.clear()
+            self._cond.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        queue = self._queue
+        while True:
+            with self._cond:
+                while not queue and self._running:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                batch = list(queue)
+                queue.clear()
+                comms = self._comms
+                node_comms = self._node_comms
+
+            for sent, sender, pkg in batch:
+                if self._decoder:
+                    decoded = self._decoder.feed(pkg)
+                    if not decoded:
+                        continue
+                    pkg = decoded[0]
+                for comm in comms:
+                    if comm is not sender:
+                        comm._deliver(pkg)
+                if pkg.meta.mtype == AsbMessageType.ASB_PKGTYPE_UNICAST:
+                    comm = node_comms.get(pkg.meta.target)
+                    if comm is not None and comm is not sender:
+                        comm._deliver(pkg)
+
+                latency = time.perf_counter() - sent
+                self.delivered += 1
+                self.latency_sum += latency
+                if latency > self.latency_max:
+                    self.latency_max = latency
+
+
+class AsbSimComm(AsbComm):
+    """ Communication interface connected to an AsbLoopbackBus, callbacks are called from the bus thread """
+
+    def __init__(self, bus: AsbLoopbackBus, node_id: int|None = None) -> None:
+        """
+        Initialize the interface and connect it to the bus
+
+        Parameters:
+            bus (AsbLoopbackBus): The bus
+            node_id (int|None): Only receive unicast packets to this node ID, None = receive all packets
+        """
+        self.node_id = node_id
+        self._bus = bus
+        self._callbacks: list[Callable[[AsbPacket|None], None]] = []
+        bus.attach(self)
+
+    def _deliver(self, pkg: AsbPacket) -> None:
+        for callback in self._callbacks:
+            callback(pkg)
+
+    def register_callback(self, callback: Callable[[AsbPacket|None], None]) -> None:
+        self._callbacks.append(callback)
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        return self._bus.send(self, pkg)
+
+
+@dataclass
+class AsbSimModule:
+    """
+    I/O module of a simulated node, reported on ASB_CMD_REQ_MODULES
+
+    Attributes:
+        cfg_id (int): Config ID
+        mod_type (AsbIoModuleType): Module type
+        address (int): Address of the configuration in EEPROM
+        length (int): Length of the configuration in EEPROM
+    """
+    cfg_id: int
+    mod_type: AsbIoModuleType
+    address: int
+    length: int
+
+
+class AsbSimNode:
+    """
+    A virtual node on an AsbLoopbackBus
+
+    Answers pings and module requests like the firmware, sends a boot message when started
+    and periodically sends heartbeats and temperature values to a multicast group.
+    """
+
+    def __init__(self, bus: AsbLoopbackBus, node_id: int, modules: list[AsbSimModule]|None = None,
+                 heartbeat_interval: float = 0.0, sensor_rate: float = 0.0, sensor_target: int = 0x1000) -> None:
+        """
+        Initialize the node and connect it to the bus
+
+        Parameters:
+            bus (AsbLoopbackBus): The bus
+            node_id (int): The node ID (0x001-0x7FF)
+            modules (list[AsbSimModule]|None): The I/O modules of the node
+            heartbeat_interval (float): Time in seconds between heartbeats, 0 = none
+            sensor_rate (float): Number of sensor values per second, 0 = none
+            sensor_target (int): Multicast group of the sensor values
+        """
+        self.node_id = node_id
+        self.modules = modules or []
+        self.heartbeat_interval = heartbeat_interval
+        self.sensor_rate = sensor_rate
+        self.sensor_target = sensor_target
+
+        self._bus = bus
+        self._comm = AsbSimComm(bus, node_id)
+        self._comm.register_callback(self._callback)
+        self._start_time = time.monotonic()
+        self._value = random.randint(150, 250)  # temperature in 0.1 °C
+        self._running = False
+
+    def start(self) -> None:
+        """ Send the boot message and start the periodic messages """
+        self._running = True
+        self._start_time = time.monotonic()
+        self._send(AsbMessageType.ASB_PKGTYPE_BROADCAST, ASB_SIM_BROADCAST_TARGET, -1, [AsbCommand.ASB_CMD_BOOT])
+
+        if self.heartbeat_interval > 0:
+            self._bus.scheduler.call_later(self.heartbeat_interval, self._heartbeat)
+        if self.sensor_rate > 0:
+            # random phase, so the nodes do not send at the same time
+            self._bus.scheduler.call_later(random.random() / self.sensor_rate, self._sensor, time.monotonic())
+
+    def stop(self) -> None:
+        """ Stop the periodic messages """
+        self._running = False
+
+    def _send(self, mtype: AsbMessageType, target: int, port: int, data: list[int]) -> bool:
+        return self._comm.send_packet(AsbPacket(AsbMeta(mtype, port, target, self.node_id), len(data), data))
+
+    def _heartbeat(self) -> None:
+        if not self._running:
+            return
+        uptime = int((time.monotonic() - self._start_time) * 1000)
+        self._send(AsbMessageType.ASB_PKGTYPE_BROADCAST, ASB_SIM_BROADCAST_TARGET, -1,
+                   [AsbCommand.ASB_CMD_HEARTBEAT, (uptime >> 24) & 0xFF, (uptime >> 32) & 0xFF])
+        self._bus.scheduler.call_later(self.heartbeat_interval, self._heartbeat)
+
+    def _sensor(self, due: float) -> None:
+        if not self._running:
+            return
+
+        # catch up if the scheduler fell behind, so the average rate is kept under load
+        interval = 1 / self.sensor_rate
+        now = time.monotonic()
+        while due <= now:
+            self._value += random.randint(-1, 1)
+            value = self._value & 0xFFFF
+            self._send(AsbMessageType.ASB_PKGTYPE_MULTICAST, self.sensor_target, -1,
+                       [AsbCommand.ASB_CMD_S_TEMP, value >> 8, value & 0xFF])
+            due += interval
+
+        self._bus.scheduler.call_later(due - now, self._sensor, due)
+
+    def _callback(self, pkg: AsbPacket) -> None:
+        if pkg.len < 1:
+            return
+
+        if pkg.data[0] == AsbCommand.ASB_CMD_PING:
+            self._send(AsbMessageType.ASB_PKGTYPE_UNICAST, pkg.meta.source, pkg.meta.port, [AsbCommand.ASB_CMD_PONG])
+        elif pkg.data[0] == AsbCommand.ASB_CMD_REQ_MODULES:
+            for module in self.modules:
+                self._send(AsbMessageType.ASB_PKGTYPE_UNICAST, pkg.meta.source, pkg.meta.port, [
+                    AsbCommand.ASB_CMD_RES_MODULES, module.cfg_id, module.mod_type.value,
+                    module.address >> 8, module.address & 0xFF, module.length
+                ])
@@ -0,0 +1,176 @@
+# ASB communication over a native CAN interface using Linux SocketCAN (e.g. can0 or vcan0)
+
+from typing import Callable, Iterable
+
+import select
+import socket
+import struct
+import threading
+import time
+
+from asysbuslib.asb_can import asb_can_id_decode, asb_can_id_encode, asb_can_id_filter, ASB_CAN_ID_MASK
+from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_proto import AsbMessageType, AsbPacket
+
+
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+
+# struct can_frame: identifier with flags, length, padding, data
+_CAN_FRAME = struct.Struct("=IB3x8s")
+# struct can_filter: identifier, mask
+_CAN_FILTER = struct.Struct("=II")
+
+# maximum number of frames handled per wakeup of the reader thread
+ASB_SOCKETCAN_MAX_BATCH = 64
+
+
+def asb_socketcan_filters(criteria: Iterable[tuple[AsbMessageType|None, int|None, int|None]], node_id: int|None = None) -> list[tuple[int, int]]|None:
+    """
+    Get the identifier and mask pairs receiving the packets selected by criteria like the ones of AsbInterface.subscribe
+
+    Parameters:
+        criteria (Iterable[tuple[AsbMessageType|None, int|None, int|None]]): Message type, target and port of each selection (see asb_can_id_filter)
+        node_id (int|None): Also receive unicast packets to this node (e.g. pongs)
+
+    Returns:
+        list[tuple[int, int]]|None: The filters for AsbSocketCan.set_filters, None if all packets are needed
+    """
+    filters = {asb_can_id_filter(mtype, target, port) for mtype, target, port in criteria}
+    if node_id is not None:
+        filters.add(asb_can_id_filter(AsbMessageType.ASB_PKGTYPE_UNICAST, node_id))
+
+    # a selection of all packets makes the other filters pointless
+    if any(mask == 0 for _, mask in filters):
+        return None
+
+    return sorted(filters)
+
+
+def asb_socketcan_pack_filters(filters: Iterable[tuple[int, int]]|None) -> bytes:
+    """
+    Pack identifier and mask pairs to the struct can_filter array expected by CAN_RAW_FILTER
+
+    Only extended data frames match, independent of the filters.
+
+    Parameters:
+        filters (Iterable[tuple[int, int]]|None): Identifier and mask pairs (see asb_can_id_filter), None = all packets
+
+    Returns:
+        bytes: The filter array
+    """
+    if filters is None:
+        filters = [(0, 0)]
+    flags = CAN_EFF_FLAG | CAN_RTR_FLAG
+    return b"".join(_CAN_FILTER.pack((can_id & ASB_CAN_ID_MASK) | CAN_EFF_FLAG, (mask & ASB_CAN_ID_MASK) | flags)
+                    for can_id, mask in filters)
+
+
+class AsbSocketCan(AsbComm):
+    """
+    ASB communication over a SocketCAN interface
+
+    The reader thread blocks until a frame arrives and then takes all frames already queued
+    in the socket (up to ASB_SOCKETCAN_MAX_BATCH) before calling the callbacks, so a burst
+    costs one wakeup instead of one per frame.
+    """
+
+    def __init__(self, interface: str = "can0"):
+        """
+        Initialize the ASB communication class
+
+        Parameters:
+            interface (str): The CAN network interface (e.g. can0 or vcan0)
+        """
+        self._sock = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        self._sock.bind((interface,))
+        self._sock.setblocking(False)
+
+        self._callbacks: list[Callable[[AsbPacket|None], None]] = []
+
+        self._read_thread_running = True
+        self._read_thread = threading.Thread(target=self._read_task)
+        self._read_thread.start()
+
+    def stop(self) -> None:
+        self._read_thread_running = False
+        self._read_thread.join()
+        self._sock.close()
+
+    def set_filters(self, filters: Iterable[tuple[int, int]]|None) -> None:
+        """
+        Let the kernel drop all frames not matching one of the filters
+
+        Only extended data frames are received, independent of the filters.
+
+        Parameters:
+            filters (Iterable[tuple[int, int]]|None): Identifier and mask pairs (see asb_can_id_filter), None = receive all packets
+        """
+        self._sock.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FILTER, asb_socketcan_pack_filters(filters))
+
+    def set_filters_from_criteria(self, criteria: Iterable[tuple[AsbMessageType|None, int|None, int|None]], node_id: int|None = None) -> None:
+        """
+        Receive only the packets selected by the criteria (see asb_socketcan_filters)
+
+        To receive what an AsbInterface needs pass the message type, target and port of its
+        subscriptions (see AsbInterface.get_subscriptions). Note that AsbInterface also uses
+        all received packets for node discovery, which is limited to the selected packets afterwards.
+
+        Parameters:
+            criteria (Iterable[tuple[AsbMessageType|None, int|None, int|None]]): Message type, target and port of each selection
+            node_id (int|None): Also receive unicast packets to this node (e.g. pongs)
+        """
+        self.set_filters(asb_socketcan_filters(criteria, node_id))
+
+    def _read_task(self) -> None:
+        sock = self._sock
+        frame_size = _CAN_FRAME.size
+        while self._read_thread_running:
+            if not select.select([sock], [], [], 0.1)[0]:
+                continue
+
+            # take what is already queued without waiting
+            frames = []
+            try:
+                while len(frames) < ASB_SOCKETCAN_MAX_BATCH:
+                    frames.append(sock.recv(frame_size))
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:  # e.g. interface down
+                time.sleep(0.1)
+
+            for frame in frames:
+                pkg = self._decode_frame(frame)
+                if pkg is None:
+                    continue
+                for callback in self._callbacks:
+                    callback(pkg)
+
+    @staticmethod
+    def _decode_frame(frame: bytes) -> AsbPacket|None:
+        if len(frame) != _CAN_FRAME.size:
+            return None
+        can_id, length, data = _CAN_FRAME.unpack(frame)
+        if not can_id & CAN_EFF_FLAG or can_id & (CAN_RTR_FLAG | CAN_ERR_FLAG) or length > 8:
+            return None
+
+        meta = asb_can_id_decode(can_id & ASB_CAN_ID_MASK)
+        if meta is None or meta.source < 0x0001 or (meta.target < 0x0001 and meta.mtype != AsbMessageType.ASB_PKGTYPE_BROADCAST):
+            return None
+
+        return AsbPacket(meta, length, list(data[:length]))
+
+    def register_callback(self, callback: Callable[[AsbPacket|None], None]) -> None:
+        self._callbacks.append(callback)
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        can_id = asb_can_id_encode(pkg.meta)
+        if can_id == 0 or pkg.len < 0 or pkg.len > 8 or len(pkg.data) != pkg.len:
+            return False
+
+        try:
+            self._sock.send(_CAN_FRAME.pack(can_id | CAN_EFF_FLAG, pkg.len, bytes(pkg.data)))
+        except (OSError, ValueError):  # e.g. transmit queue full (the socket does not block), data bytes out of range
+            return False
+        return True
@@ -0,0 +1,292 @@
+# Last known on/off and percent values of the multicast groups, with change notifications and persistence
+
+from dataclasses import asdict, dataclass
+from typing import Callable
+
+import json
+import logging
+import os
+import threading
+import time
+
+from asysbuslib.asb_proto import AsbMessageType, AsbCommand, AsbPacket
+
+
+# commands whose value is kept as state of the group
+ASB_STATE_COMMANDS = (AsbCommand.ASB_CMD_1B, AsbCommand.ASB_CMD_PER, AsbCommand.ASB_CMD_S_PER)
+
+ASB_STATE_FILE_VERSION = 1
+
+# plain ints for the checks on every packet, comparing with enum members is slower
+_MULTICAST = int(AsbMessageType.ASB_PKGTYPE_MULTICAST)
+_STATE_COMMANDS = frozenset(int(cmd) for cmd in ASB_STATE_COMMANDS)
+
+
+@dataclass
+class AsbGroupState:
+    """
+    Last known value of a multicast group
+
+    Attributes:
+        group (int): The multicast group (target address)
+        cmd (int): The command of the value (ASB_CMD_1B, ASB_CMD_PER or ASB_CMD_S_PER)
+        value (int): The value (0/1 or 0-100)
+        time (float): UNIX timestamp of the last packet with this value
+        changed_by (int): Source address of the packet that set the value
+    """
+    group: int
+    cmd: int
+    value: int
+    time: float
+    changed_by: int
+
+
+@dataclass(eq=False)
+class AsbStateSubscription:
+    """
+    Subscription handle returned by AsbStateStore.subscribe
+
+    Attributes:
+        callback (function): The callback function (def my_callback(state: AsbGroupState, previous: AsbGroupState|None) -> None)
+        group (int|None): The group subscribed to (None = all groups)
+    """
+    callback: Callable[[AsbGroupState, AsbGroupState|None], None]
+    group: int|None
+
+
+class AsbStateStore:
+    """
+    Store of the last known value per multicast group
+
+    Subscriptions are only called when the value of a group changes, repeated packets with the same
+    value (e.g. periodic multicasts) only refresh the time. With a TTL, groups without a packet for
+    longer than the TTL are considered unknown. The store can be saved to and loaded from a JSON file,
+    so a restarted program knows the states without asking every node.
+    """
+
+    def __init__(self, ttl: float = 0.0) -> None:
+        """
+        Initialize the state store
+
+        Parameters:
+            ttl (float): Time in seconds after which a state without update expires (0 = never)
+        """
+        self.ttl = ttl
+
+        self._states: dict[int, AsbGroupState] = {}
+        self._lock = threading.Lock()
+        self._next_eviction = 0.0
+
+        # {group or None: [subscriptions]}, replaced on every change (copy-on-write)
+        self._subscriptions: dict[int|None, list[AsbStateSubscription]] = {}
+
+    def update(self, pkg: AsbPacket) -> bool:
+        """
+        Update the state from a packet, called by AsbInterface for every packet
+
+        Parameters:
+            pkg (AsbPacket): The packet, other than multicast state commands are ignored
+
+        Returns:
+            bool: True if the value of the group changed
+        """
+        meta = pkg.meta
+        if meta.mtype != _MULTICAST or pkg.len < 2 or pkg.data[0] not in _STATE_COMMANDS:
+            return False
+
+        return self.set(meta.target, pkg.data[0], pkg.data[1], meta.source)
+
+    def set(self, group: int, cmd: int, value: int, source: int, timestamp: float|None = None) -> bool:
+        """
+        Set the state of a group
+
+        Parameters:
+            group (int): The multicast group
+            cmd (int): The command of the value
+            value (int): The value
+            source (int): Source address of the value
+            timestamp (float|None): UNIX timestamp of the value (None = now)
+
+        Returns:
+            bool: True if the value of the group changed
+        """
+        now = time.time() if timestamp is None else timestamp
+        ttl = self.ttl
+        if ttl > 0 and now >= self._next_eviction:
+            self.evict_expired()
+
+        with self._lock:
+            previous = self._states.get(group)
+            if previous is not None and previous.cmd == cmd and previous.value == value and (ttl <= 0 or now - previous.time <= ttl):
+                previous.time = now
+                return False
+            state = AsbGroupState(group, int(cmd), value, now, source)
+            self._states[group] = state
+
+        subscriptions = self._subscriptions
+        for sub in subscriptions.get(group, []) + subscriptions.get(None, []):
+            try:
+                sub.callback(state, previous)
+            except Exception:
+                logging.getLogger(__name__).exception("State callback %r failed", sub.callback)
+
+        return True
+
+    def get(self, group: int) -> AsbGroupState|None:
+        """
+        Get the state of a group
+
+        Parameters:
+            group (int): The multicast group
+
+        Returns:
+            AsbGroupState|None: The state or None if it is unknown or expired
+        """
+        state = self._states.get(group)
+        if state is None or self._expired(state, time.time()):
+            return None
+        return state
+
+    def get_all(self) -> list[AsbGroupState]:
+        """
+        Get the states of all groups
+
+        Returns:
+            list[AsbGroupState]: The states that are not expired, ordered by group
+        """
+        now = time.time()
+        with self._lock:
+            states = [state for state in self._states.values() if not self._expired(state, now)]
+        states.sort(key=lambda state: state.group)
+
+        return states
+
+    def evict_expired(self) -> int:
+        """
+        Remove the expired states, also done while updating at most once per TTL
+
+        Returns:
+            int: The number of removed states
+        """
+        if self.ttl <= 0:
+            return 0
+
+        now = time.time()
+        with self._lock:
+            expired = [group for group, state in self._states.items() if self._expired(state, now)]
+            for group in expired:
+                del self._states[group]
+            self._next_eviction = now + self.ttl
+
+        return len(expired)
+
+    def _expired(self, state: AsbGroupState, now: float) -> bool:
+        return self.ttl > 0 and now - state.time > self.ttl
+
+    def subscribe(self, callback: Callable[[AsbGroupState, AsbGroupState|None], None], group: int|None = None) -> AsbStateSubscription:
+        """
+        Subscribe to value changes
+
+        Parameters:
+            callback (function): Called with the new and the previous state (None if unknown) when a value changes
+            group (int|None): The group to subscribe to (None = all groups)
+
+        Returns:
+            AsbStateSubscription: Handle to pass to unsubscribe
+        """
+        sub = AsbStateSubscription(callback, group)
+        with self._lock:
+            subscriptions = dict(self._subscriptions)
+            subscriptions[group] = subscriptions.get(group, []) + [sub]
+            self._subscriptions = subscriptions
+
+        return sub
+
+    def unsubscribe(self, sub: AsbStateSubscription) -> bool:
+        """
+        Remove a subscription
+
+        Parameters:
+            sub (AsbStateSubscription): The handle returned by subscribe
+
+        Returns:
+            bool: True if the subscription was removed, False if it was not subscribed
+        """
+        with self._lock:
+            if sub not in self._subscriptions.get(sub.group, []):
+                return False
+
+            subscriptions = dict(self._subscriptions)
+            subscriptions[sub.group] = [s for s in subscriptions[sub.group] if s is not sub]
+            if not subscriptions[sub.group]:
+                del subscriptions[sub.group]
+            self._subscriptions = subscriptions
+
+        return True
+
+    def snapshot(self) -> dict:
+        """
+        Get the states as dictionary that can be stored as JSON
+
+        Returns:
+            dict: The file version and the states
+        """
+        return {"version": ASB_STATE_FILE_VERSION, "states": [asdict(state) for state in self.get_all()]}
+
+    def restore(self, snapshot: dict) -> int:
+        """
+        Load states from a snapshot, without calling the subscriptions
+
+        States that are already expired are skipped, states newer than the loaded ones are kept.
+
+        Parameters:
+            snapshot (dict): The snapshot (see snapshot)
+
+        Returns:
+            int: The number of loaded states
+        """
+        if snapshot.get("version") != ASB_STATE_FILE_VERSION:
+            raise ValueError(f"Unsupported state snapshot version {snapshot.get('version')}")
+
+        now = time.time()
+        loaded = 0
+        with self._lock:
+            for values in snapshot["states"]:
+                state = AsbGroupState(**values)
+                current = self._states.get(state.group)
+                if self._expired(state, now) or (current is not None and current.time >= state.time):
+                    continue
+                self._states[state.group] = state
+                loaded += 1
+
+        return loaded
+
+    def save(self, path: str) -> None:
+        """
+        Save the states to a JSON file, the file is replaced atomically
+
+        Parameters:
+            path (str): The file path
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> int:
+        """
+        Load the states from a JSON file written by save
+
+        Parameters:
+            path (str): The file path
+
+        Returns:
+            int: The number of loaded states, 0 if the file does not exist
+        """
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return 0
+
+        return self.restore(snapshot)
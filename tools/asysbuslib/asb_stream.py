@@ -0,0 +1,111 @@
+from typing import Iterable, Iterator
+
+from asysbuslib.asb_endecode import asb_pkg_decode_bytes
+from asysbuslib.asb_proto import AsbPacket
+
+
+# longest unterminated line kept while waiting for more data (an encoded packet is at most 44 bytes)
+ASB_STREAM_MAX_LINE = 256
+
+
+class AsbStreamDecoder:
+    """
+    Incremental decoder for the byte stream of the serial ASB interface
+
+    Accepts chunks of arbitrary size (e.g. whatever the serial port returned) and decodes
+    all complete lines. Only the unterminated tail of the stream is kept between calls,
+    so the cost per chunk does not depend on how much data was received before.
+
+    Attributes:
+        frames (int): Number of valid packets decoded
+        invalid (int): Number of non-empty lines that could not be decoded
+        dropped_bytes (int): Number of bytes discarded because a line exceeded max_line
+    """
+
+    def __init__(self, max_line: int = ASB_STREAM_MAX_LINE) -> None:
+        """
+        Initialize the stream decoder
+
+        Parameters:
+            max_line (int): Maximum length of an unterminated line before it is discarded
+        """
+        self._buf = bytearray()
+        self._max_line = max_line
+
+        self.frames = 0
+        self.invalid = 0
+        self.dropped_bytes = 0
+
+    def reset(self) -> None:
+        """ Discard a partially received line, e.g. after reopening the port """
+        self._buf.clear()
+
+    def iter_feed(self, data: bytes) -> Iterator[AsbPacket]:
+        """
+        Feed a chunk of received bytes and decode the completed lines one by one
+
+        Parameters:
+            data (bytes): The received bytes
+
+        Returns:
+            Iterator[AsbPacket]: Generator yielding the decoded packets
+        """
+        if not isinstance(data, bytes):
+            data = bytes(data)
+
+        buf = self._buf
+        end = data.rfind(b'\n')
+        if end < 0:
+            lines = []
+            buf += data
+        elif buf:
+            lines = (bytes(buf) + data[:end]).split(b'\n')
+            buf[:] = data[end + 1:]
+        else:
+            lines = data[:end].split(b'\n')
+            buf += data[end + 1:]
+
+        if len(buf) > self._max_line:
+            self.dropped_bytes += len(buf)
+            buf.clear()
+
+        return self._decode_lines(lines)
+
+    def _decode_lines(self, lines: list[bytes]) -> Iterator[AsbPacket]:
+        for line in lines:
+            if len(line) < 2:  # empty line or CR only
+                continue
+            pkg = asb_pkg_decode_bytes(line)
+            if pkg is None:
+                self.invalid += 1
+                continue
+            self.frames += 1
+            yield pkg
+
+    def feed(self, data: bytes) -> list[AsbPacket]:
+        """
+        Feed a chunk of received bytes and decode the completed lines
+
+        Parameters:
+            data (bytes): The received bytes
+
+        Returns:
+            list[AsbPacket]: The decoded packets in order of reception
+        """
+        return list(self.iter_feed(data))
+
+    def decode_many(self, chunks: Iterable[bytes]) -> list[AsbPacket]:
+        """
+        Feed several chunks of received bytes at once
+
+        Parameters:
+            chunks (Iterable[bytes]): The received chunks in order
+
+        Returns:
+            list[AsbPacket]: The decoded packets of all chunks in order of reception
+        """
+        pkgs: list[AsbPacket] = []
+        for data in chunks:
+            pkgs.extend(self.iter_feed(data))
+
+        return pkgs
@@ -0,0 +1,106 @@
+from typing import Callable
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class AsbTimerHandle:
+    """
+    Handle of a scheduled call, returned by AsbTimerScheduler.call_later
+
+    Compatible with asyncio.TimerHandle (cancel), so an event loop can be used as scheduler as well.
+    """
+
+    __slots__ = ("deadline", "_callback", "_args", "_cancelled")
+
+    def __init__(self, deadline: float, callback: Callable, args: tuple) -> None:
+        self.deadline = deadline
+        self._callback = callback
+        self._args = args
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        """ Cancel the call if it did not run yet """
+        self._cancelled = True
+        self._callback = None
+        self._args = ()
+
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+
+class AsbTimerScheduler:
+    """
+    Runs callbacks at a deadline on a background thread
+
+    Deadlines are kept in a heap, so scheduling and cancelling thousands of concurrent timeouts
+    costs O(log n) each. Cancelled entries are dropped when they reach the top of the heap.
+    The thread is started on the first call_later and exits with the program (daemon).
+    """
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, AsbTimerHandle]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: threading.Thread|None = None
+        self._running = True
+
+    def call_later(self, delay: float, callback: Callable, *args) -> AsbTimerHandle:
+        """
+        Call a function after a delay
+
+        Parameters:
+            delay (float): Delay in seconds
+            callback (function): The function to call from the scheduler thread
+            args: Arguments to pass to the function
+
+        Returns:
+            AsbTimerHandle: Handle to cancel the call
+        """
+        handle = AsbTimerHandle(time.monotonic() + delay, callback, args)
+
+        with self._cond:
+            if self._thread is None and self._running:
+                self._thread = threading.Thread(target=self._run, name="AsbTimerScheduler", daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (handle.deadline, next(self._seq), handle))
+            if self._heap[0][2] is handle:
+                self._cond.notify()  # new earliest deadline
+
+        return handle
+
+    def stop(self) -> None:
+        """ Stop the scheduler thread, pending calls are discarded """
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                handle = heapq.heappop(self._heap)[2]
+
+            callback, args = handle._callback, handle._args
+            if callback is None:  # cancelled
+                continue
+            handle._callback = None
+            try:
+                callback(*args)
+            except Exception:
+                logging.getLogger(__name__).exception("Timer callback %r failed", callback)
@@ -1,54 +1,280 @@
+from collections import deque
 from typing import Callable
 
+import logging
 import serial
-import io
 import threading
+import time
 
+from asysbuslib.asb_binary import AsbBinaryStreamDecoder, asb_binary_encode, ASB_BINARY_ACK, ASB_BINARY_END, ASB_BINARY_REQUEST
 from asysbuslib.asb_comm import AsbComm
-from asysbuslib.asb_endecode import asb_pkg_decode, asb_pkg_encode
+from asysbuslib.asb_dispatch import AsbBackpressure, AsbDispatcher, ASB_DISPATCH_QUEUE_LEN
+from asysbuslib.asb_endecode import asb_pkg_encode_bytes, asb_pkg_encode_into
+from asysbuslib.asb_metrics import AsbMetrics
 from asysbuslib.asb_proto import AsbPacket
+from asysbuslib.asb_stream import AsbStreamDecoder
+
+
+# time to wait for the node to acknowledge binary framing, long enough for a node reset by opening the port
+ASB_BINARY_NEGOTIATE_SEC = 3.0
+# interval between two binary framing requests while waiting
+ASB_BINARY_RETRY_SEC = 0.25
 
 
 class AsbUart(AsbComm):
 
-    def __init__(self, port: str, baudrate: int):
+    def __init__(self, port: str, baudrate: int, dispatch_workers: int = 0, dispatch_queue: int = ASB_DISPATCH_QUEUE_LEN,
+                 dispatch_policy: AsbBackpressure = AsbBackpressure.BLOCK, tx_max_batch: int = 0, tx_linger_us: int = 0,
+                 binary: bool = False, metrics: AsbMetrics|None = None):
         """
         Initialize the ASB communication class
 
+        By default the callbacks run on the reader thread. With dispatch_workers > 0 the reader only
+        decodes and the callbacks run on a pool of worker threads (see AsbDispatcher), so slow callbacks
+        do not delay reading. Packets of the same source are still handled in order.
+
+        By default send_packet writes to the port directly. With tx_max_batch > 0 the packets are queued
+        and a writer thread combines up to tx_max_batch pending packets into one write, waiting at most
+        tx_linger_us for more packets to arrive. The tx_frames and tx_writes counters show the effect.
+        Failed writes of the writer thread are logged and counted in tx_errors, the packets are lost.
+        After stop sending returns False.
+
+        With binary=True the node is asked to switch to binary framing (see docs/uart_protocol.md),
+        which needs about half the bytes per packet. If the node does not acknowledge it (older firmware),
+        the ASCII protocol is used. The binary attribute tells which one is active.
+
+        With metrics the received and sent bytes and frames, decode failures, the decode time per
+        read chunk and the time to dispatch every packet (callbacks or dispatcher queue) are recorded.
+
         Parameters:
             port (str): The serial port of the ASB interface (e.g. /dev/ttyUSB0)
             baudrate (int): The baudrate to use (e.g. 115200)
+            dispatch_workers (int): Number of callback worker threads (0 = call on the reader thread)
+            dispatch_queue (int): Maximum number of packets waiting per worker
+            dispatch_policy (AsbBackpressure): What to do when a worker queue is full
+            tx_max_batch (int): Maximum number of packets per write (0 = write directly from the caller)
+            tx_linger_us (int): Time in microseconds to wait for more packets before writing an incomplete batch
+            binary (bool): Try to use binary framing
+            metrics (AsbMetrics|None): Record counters and latencies (None = disabled)
         """
         self._ser = serial.Serial(port, baudrate, timeout=0.01)
-        self._sio = io.TextIOWrapper(io.BufferedRWPair(self._ser, self._ser))  # type: ignore
+        self._metrics = metrics
+        self._decoder: AsbStreamDecoder|AsbBinaryStreamDecoder = AsbStreamDecoder()
+        self._encode = asb_pkg_encode_bytes
+
+        self.binary = False
+        if binary:
+            self._negotiate_binary()
 
         self._callbacks: list[Callable[[AsbPacket|None], None]] = []
 
+        self.dispatcher: AsbDispatcher|None = None
+        if dispatch_workers > 0:
+            self.dispatcher = AsbDispatcher(self._call_callbacks, dispatch_workers, dispatch_queue, dispatch_policy)
+
+        self.tx_frames = 0
+        self.tx_writes = 0
+        self.tx_errors = 0
+        self._tx_max_batch = tx_max_batch
+        self._tx_linger = tx_linger_us / 1000000
+        self._tx_queue: deque[bytes] = deque()
+        self._tx_cond = threading.Condition()
+        self._tx_running = tx_max_batch > 0
+        self._write_thread: threading.Thread|None = None
+
         self._read_thread_running = True
         self._read_thread = threading.Thread(target=self._read_task)
         self._read_thread.start()
 
+        if tx_max_batch > 0:
+            self._write_thread = threading.Thread(target=self._write_task)
+            self._write_thread.start()
+
     def stop(self) -> None:
         self._read_thread_running = False
         self._read_thread.join()
+        if self._write_thread:
+            with self._tx_cond:
+                self._tx_running = False
+                self._tx_cond.notify()
+            self._write_thread.join()  # writes the packets that are still queued
+        if self.dispatcher:
+            self.dispatcher.stop()
         self._ser.close()
 
+    def _negotiate_binary(self) -> None:
+        """
+        Ask the node for binary framing, called before the reader thread is started
+
+        Opening the port resets many nodes (DTR), so the request is repeated until the node answers.
+        Repeated requests start with an END byte: a node already in binary mode ignores the request
+        inside a frame, the END closes a frame left incomplete by a previous host program.
+        """
+        # packets received in the meantime are discarded, there are no callbacks yet
+        received = b""
+        now = time.monotonic()
+        deadline = now + ASB_BINARY_NEGOTIATE_SEC
+        retry = now
+        request = ASB_BINARY_REQUEST
+        while now < deadline:
+            if now >= retry:
+                self._ser.write(request)
+                request = bytes([ASB_BINARY_END]) + ASB_BINARY_REQUEST
+                retry = now + ASB_BINARY_RETRY_SEC
+
+            received += self._ser.read(self._ser.in_waiting or 1)
+            now = time.monotonic()
+            pos = received.find(ASB_BINARY_ACK)
+            if pos >= 0:
+                self._decoder = AsbBinaryStreamDecoder()
+                self._decoder.feed(received[pos + len(ASB_BINARY_ACK):])
+                self._encode = asb_binary_encode
+                self.binary = True
+                return
+
+        logging.getLogger(__name__).warning("Node did not acknowledge binary framing within %.1f s, using ASCII",
+                                            ASB_BINARY_NEGOTIATE_SEC)
+        self._decoder.feed(received)  # keep a partial line
+
     def _read_task(self) -> None:
+        metrics = self._metrics
         while self._read_thread_running:
-            message = self._sio.readline()
-            if message.strip():
-                pkg = asb_pkg_decode(message)
+            data = self._ser.read(self._ser.in_waiting or 1)
+            if not data:
+                continue
+
+            if metrics:
+                self._read_instrumented(data, metrics)
+            elif self.dispatcher:
+                for pkg in self._decoder.iter_feed(data):
+                    self.dispatcher.put(pkg)
+            else:
+                for pkg in self._decoder.iter_feed(data):
+                    self._call_callbacks(pkg)
+
+    def _read_instrumented(self, data: bytes, metrics: AsbMetrics) -> None:
+        """ Same as the loop in _read_task, but records metrics """
+        decoder = self._decoder
+        frames, invalid, dropped = decoder.frames, decoder.invalid, decoder.dropped_bytes
 
-                for callback in self._callbacks:
-                    callback(pkg)
+        start = time.perf_counter()
+        pkgs = decoder.feed(data)
+        metrics.observe("uart_decode_seconds", time.perf_counter() - start)
+
+        dispatch = self.dispatcher.put if self.dispatcher else self._call_callbacks
+        dispatch_seconds = metrics.histogram("uart_dispatch_seconds")
+        for pkg in pkgs:
+            start = time.perf_counter()
+            dispatch(pkg)
+            dispatch_seconds.observe(time.perf_counter() - start)
+
+        metrics.inc("uart_rx_bytes", len(data))
+        metrics.inc("uart_rx_frames", decoder.frames - frames)
+        if decoder.invalid != invalid:
+            metrics.inc("uart_rx_invalid", decoder.invalid - invalid)
+        if decoder.dropped_bytes != dropped:
+            metrics.inc("uart_rx_dropped_bytes", decoder.dropped_bytes - dropped)
+
+    def _count_write(self, frames: int, size: int) -> None:
+        self.tx_frames += frames
+        self.tx_writes += 1
+        if self._metrics:
+            self._metrics.inc("uart_tx_frames", frames)
+            self._metrics.inc("uart_tx_writes")
+            self._metrics.inc("uart_tx_bytes", size)
+
+    def _write_task(self) -> None:
+        queue = self._tx_queue
+        while True:
+            with self._tx_cond:
+                while not queue and self._tx_running:
+                    self._tx_cond.wait()
+                if not queue:
+                    return
+
+                # give the caller the chance to queue more packets for the same write
+                if self._tx_linger > 0:
+                    deadline = time.monotonic() + self._tx_linger
+                    while len(queue) < self._tx_max_batch and self._tx_running:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                        self._tx_cond.wait(timeout)
+
+                count = min(len(queue), self._tx_max_batch)
+                batch = [queue.popleft() for _ in range(count)]
+
+            message = b"".join(batch)
+            try:
+                self._ser.write(message)
+            except Exception:  # e.g. the port was unplugged, keep the thread alive for the next packets
+                self.tx_errors += 1
+                if self._metrics:
+                    self._metrics.inc("uart_tx_errors")
+                    self._metrics.inc("uart_tx_lost_frames", count)
+                logging.getLogger(__name__).exception("Serial write of %d packets failed", count)
+                continue
+            self._count_write(count, len(message))
+
+    def _call_callbacks(self, pkg: AsbPacket) -> None:
+        for callback in self._callbacks:
+            callback(pkg)
 
     def register_callback(self, callback: Callable[[AsbPacket|None], None]) -> None:
         self._callbacks.append(callback)
 
     def send_packet(self, pkg: AsbPacket) -> bool:
-        message = asb_pkg_encode(pkg)
+        message = self._encode(pkg)
         if not message:
+            if self._metrics:
+                self._metrics.inc("uart_tx_invalid")
             return False
-        self._sio.write(message)
-        self._sio.flush()
+
+        if self._write_thread:
+            with self._tx_cond:
+                if not self._tx_running:
+                    return False
+                self._tx_queue.append(message)
+                self._tx_cond.notify()
+        else:
+            self._ser.write(message)
+            self._count_write(1, len(message))
         return True
+
+    def send_packets(self, pkgs: list[AsbPacket]) -> list[bool]:
+        """
+        Send several ASB packages with as few writes as possible
+
+        Parameters:
+            pkgs (list[AsbPacket]): The packages to send
+
+        Returns:
+            list[bool]: For every package True if it was sent (or queued), False if it is invalid or the writer thread is stopped
+        """
+        if self._write_thread:
+            messages = [self._encode(pkg) for pkg in pkgs]
+            with self._tx_cond:
+                if not self._tx_running:
+                    return [False] * len(pkgs)
+                self._tx_queue.extend(message for message in messages if message)
+                self._tx_cond.notify()
+            results = [bool(message) for message in messages]
+        else:
+            if self.binary:
+                messages = [asb_binary_encode(pkg) for pkg in pkgs]
+                buf = b"".join(messages)
+                results = [bool(message) for message in messages]
+            else:
+                buf = bytearray()
+                results = []
+                for pkg in pkgs:
+                    written = asb_pkg_encode_into(buf, len(buf), pkg)
+                    results.append(written > 0)
+
+            if buf:
+                self._ser.write(buf)
+                self._count_write(results.count(True), len(buf))
+
+        if self._metrics and not all(results):
+            self._metrics.inc("uart_tx_invalid", results.count(False))
+        return results
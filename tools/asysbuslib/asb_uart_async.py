@@ -0,0 +1,88 @@
+from typing import Callable
+
+import asyncio
+import serial_asyncio
+
+from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_endecode import asb_pkg_encode_bytes
+from asysbuslib.asb_proto import AsbPacket
+from asysbuslib.asb_stream import AsbStreamDecoder
+
+
+class AsbUartAsync(AsbComm, asyncio.Protocol):
+    """
+    ASB communication over the serial ASB interface, driven by an asyncio event loop
+
+    Received packets are decoded in data_received and the callbacks are called from the event loop,
+    so no reader thread is needed and one loop can serve several interfaces.
+    Use AsbUartAsync.create to open the port.
+    """
+
+    def __init__(self) -> None:
+        self._transport: asyncio.Transport|None = None
+        self._decoder = AsbStreamDecoder()
+        self._closed: asyncio.Future|None = None
+
+        self._callbacks: list[Callable[[AsbPacket|None], None]] = []
+
+    @classmethod
+    async def create(cls, port: str, baudrate: int) -> "AsbUartAsync":
+        """
+        Open the serial port on the running event loop
+
+        Parameters:
+            port (str): The serial port of the ASB interface (e.g. /dev/ttyUSB0)
+            baudrate (int): The baudrate to use (e.g. 115200)
+
+        Returns:
+            AsbUartAsync: The connected interface
+        """
+        loop = asyncio.get_running_loop()
+        uart = cls()
+        uart._closed = loop.create_future()
+        await serial_asyncio.create_serial_connection(loop, lambda: uart, port, baudrate=baudrate)
+
+        return uart
+
+    def stop(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    async def wait_closed(self) -> None:
+        """ Wait until the port is closed, raises the error if the connection was lost """
+        if self._closed is not None:
+            await self._closed
+
+    # asyncio.Protocol
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = transport
+        self._decoder.reset()
+
+    def data_received(self, data: bytes) -> None:
+        for pkg in self._decoder.iter_feed(data):
+            for callback in self._callbacks:
+                callback(pkg)
+
+    def connection_lost(self, exc: Exception|None) -> None:
+        self._transport = None
+        if self._closed is not None and not self._closed.done():
+            if exc is None:
+                self._closed.set_result(None)
+            else:
+                self._closed.set_exception(exc)
+
+    # AsbComm
+
+    def register_callback(self, callback: Callable[[AsbPacket|None], None]) -> None:
+        self._callbacks.append(callback)
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        """ Queue the packet on the transport, the event loop writes it without blocking """
+        if self._transport is None:
+            return False
+        message = asb_pkg_encode_bytes(pkg)
+        if not message:
+            return False
+        self._transport.write(message)
+        return True
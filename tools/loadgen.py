@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Load generator: runs AsbInterface against simulated nodes on an in-process bus and reports throughput and latency
+# Usage: python loadgen.py [--nodes N] [--rate FRAMES_PER_SEC_PER_NODE] [--duration SEC] [--codec none|ascii|binary] [--subs N]
+import argparse
+import statistics
+import time
+
+from asysbuslib.asb_interface import AsbInterface
+from asysbuslib.asb_node import AsbIoModuleType
+from asysbuslib.asb_proto import AsbMessageType, AsbCommand
+from asysbuslib.asb_sim import AsbLoopbackBus, AsbSimComm, AsbSimModule, AsbSimNode
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate load on a simulated ASB bus")
+    parser.add_argument("--nodes", type=int, default=50, help="number of simulated nodes")
+    parser.add_argument("--rate", type=float, default=200, help="sensor values per second and node")
+    parser.add_argument("--duration", type=float, default=5, help="measurement time in seconds")
+    parser.add_argument("--codec", choices=["none", "ascii", "binary"], default="ascii", help="encode and decode every packet")
+    parser.add_argument("--subs", type=int, default=100, help="number of subscriptions on the interface")
+    parser.add_argument("--id", type=lambda x: int(x, 0), default=0x7F0, help="node ID of the interface")
+    args = parser.parse_args()
+
+    bus = AsbLoopbackBus(None if args.codec == "none" else args.codec)
+    interface = AsbInterface(args.id, AsbSimComm(bus))
+
+    nodes = [
+        AsbSimNode(bus, 0x100 + i, [AsbSimModule(1, AsbIoModuleType.ASB_IO_DIN, 0x20, 8)],
+                   heartbeat_interval=1.0, sensor_rate=args.rate, sensor_target=0x1000 + i % 64)
+        for i in range(args.nodes)
+    ]
+
+    received = 0
+
+    def count(_) -> None:
+        nonlocal received
+        received += 1
+
+    # one subscription receives all sensor values, the others only some groups
+    interface.subscribe(count, AsbMessageType.ASB_PKGTYPE_MULTICAST, cmd=AsbCommand.ASB_CMD_S_TEMP)
+    for i in range(args.subs - 1):
+        interface.subscribe(lambda pkg: None, AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1000 + i % 128)
+
+    for node in nodes:
+        node.start()
+    time.sleep(0.5)  # warm up, node discovery
+    bus.reset_stats()
+    received = 0
+
+    rtts: list[int] = []
+    timeouts = 0
+
+    def pong(success: bool, time_ms: int) -> None:
+        nonlocal timeouts
+        if success:
+            rtts.append(time_ms)
+        else:
+            timeouts += 1
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        for node in nodes:
+            interface.asb_do_ping(node.node_id, pong)
+        time.sleep(0.5)
+    elapsed = time.perf_counter() - start
+    frames, delivered, latency_sum, latency_max = bus.frames, bus.delivered, bus.latency_sum, bus.latency_max
+
+    for node in nodes:
+        node.stop()
+    time.sleep(1.1)  # let the last pings time out
+    bus.stop()
+    interface.stop()
+
+    offered = args.nodes * args.rate
+    print(f"nodes {args.nodes}, {offered:,.0f} sensor frames/s offered, codec {args.codec}, {args.subs} subscriptions")
+    print(f"bus frames         {frames / elapsed:>12,.0f} frames/s")
+    print(f"delivered          {delivered / elapsed:>12,.0f} frames/s")
+    print(f"sensor callbacks   {received / elapsed:>12,.0f} frames/s")
+    if delivered:
+        print(f"bus latency        {latency_sum / delivered * 1000:>12.3f} ms avg, {latency_max * 1000:.3f} ms max")
+    if rtts:
+        print(f"ping round trip    {statistics.mean(rtts):>12.1f} ms avg, {max(rtts)} ms max, {timeouts} timeouts")
+    else:
+        print(f"ping round trip    no pongs, {timeouts} timeouts")
+
+
+if __name__ == "__main__":
+    main()
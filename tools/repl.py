@@ -36,6 +36,7 @@ def main(node_id: int, serial_port: str, baudrate: int):
                 print("help - Show this help")
                 print("exit - Exit the REPL")
                 print("nodes - List all nodes")
+                print("busy - List the nodes sending the most packets")
                 print("modules <target> - List all I/O modules of a node")
                 print("ping <target> - Ping a node")
                 print("0bit <target> <port> - Send a 0-bit command")
@@ -52,7 +53,11 @@ def main(node_id: int, serial_port: str, baudrate: int):
                 for node in nodes:
                     booted = datetime.fromtimestamp(node.boot_time).strftime("%Y-%m-%d %H:%M:%S") if node.boot_time != -1 else "?"
                     uptime = node.reported_uptime_days if node.reported_uptime_days != -1 else "?"
-                    print(f"Node {hex(node.id)}: booted {booted}, up {uptime} days")
+                    print(f"Node {hex(node.id)}: booted {booted}, up {uptime} days, {node.rx_frames} packets received")
+
+            elif "busy" in inp:
+                for node, rate in interface.get_busiest_nodes():
+                    print(f"Node {hex(node.id)}: {rate:.1f} packets/s")
 
             elif "modules" in inp:
                 if len(inp_split) != 2:
@@ -62,11 +67,7 @@ def main(node_id: int, serial_port: str, baudrate: int):
                 if mtype != AsbMessageType.ASB_PKGTYPE_UNICAST:
                     print("Only unicast targets have modules")
                     continue
-                node = None
-                for n in interface.get_nodes():
-                    if n.id == target:
-                        node = n
-                        break
+                node = interface.get_node(target)
                 if node is None:
                     print("Node not found")
                     continue
@@ -74,7 +75,7 @@ def main(node_id: int, serial_port: str, baudrate: int):
                 for module in node.io_modules:
                     print(f"  - Config ID: {hex(module.cfg_id)}")
                     print(f"    Type: {module.mod_type.name if module.mod_type is not None else '?'}")
-                    print(f"    Address: {hex(module.address)}")
+                    print(f"    Addresses: {', '.join(hex(address) for address in module.addresses)}")
                     print(f"    Target: {hex(module.target)}")
 
             elif "ping" in inp:
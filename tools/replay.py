@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Replays a capture (see asysbuslib/asb_capture.py) through AsbInterface and reports throughput and callback latency
+# Usage: python replay.py CAPTURE [--speed FACTOR | --asap] [--subs N] [--include-tx] [--top N]
+import argparse
+
+from asysbuslib.asb_capture import asb_capture_files
+from asysbuslib.asb_interface import AsbInterface
+from asysbuslib.asb_proto import AsbMessageType
+from asysbuslib.asb_replay import AsbReplayComm
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay captured ASB traffic through AsbInterface")
+    parser.add_argument("capture", help="capture file, rotated files (CAPTURE.1, CAPTURE.2, ...) are replayed first")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed relative to the recording (default 1)")
+    parser.add_argument("--asap", action="store_true", help="replay as fast as possible")
+    parser.add_argument("--subs", type=int, default=100, help="number of subscriptions on the interface")
+    parser.add_argument("--include-tx", action="store_true", help="also replay the packets sent by the recording program")
+    parser.add_argument("--top", type=int, default=5, help="number of slowest subscriptions to show")
+    parser.add_argument("--id", type=lambda x: int(x, 0), default=0x7F0, help="node ID of the interface")
+    args = parser.parse_args()
+
+    files = asb_capture_files(args.capture)
+    if not files:
+        parser.error(f"{args.capture} does not exist")
+
+    replay = AsbReplayComm(files, 0 if args.asap else args.speed, args.include_tx)
+    interface = AsbInterface(args.id, replay, profile_callbacks=True)
+
+    # subscriptions like a bridge: some to all multicasts, the others to single groups
+    for i in range(args.subs):
+        if i % 10 == 0:
+            interface.subscribe(lambda pkg: None, AsbMessageType.ASB_PKGTYPE_MULTICAST)
+        else:
+            interface.subscribe(lambda pkg: None, AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1000 + i % 128)
+
+    replay.start()
+    try:
+        replay.wait()
+    except KeyboardInterrupt:
+        pass
+    replay.stop()
+    interface.stop()
+
+    mode = "as fast as possible" if args.asap else f"speed {args.speed:g}x"
+    print(f"{len(files)} file(s), {mode}, {args.subs} subscriptions")
+    print(f"frames             {replay.frames:>12,}")
+    print(f"throughput         {replay.frames_per_sec:>12,.0f} frames/s")
+    if replay.frames:
+        print(f"callback latency   {replay.callback_time_sum / replay.frames * 1e6:>12.1f} us avg, "
+              f"{replay.callback_time_max * 1e6:.1f} us max")
+        if not args.asap:
+            print(f"lag behind capture {replay.lag_sum / replay.frames * 1000:>12.3f} ms avg, {replay.lag_max * 1000:.3f} ms max")
+    print(f"sent (discarded)   {replay.sent:>12,}")
+
+    slowest = interface.get_slowest_subscriptions(args.top)
+    if slowest:
+        print("slowest subscriptions:")
+        for sub in slowest:
+            print(f"  {sub.total_time * 1000:10.1f} ms total, {sub.calls:>9,} calls, {sub.max_time * 1e6:8.1f} us max  {sub.describe()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import asysbuslib like the tools do, from the tools directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,20 @@
+from asysbuslib.asb_capture import AsbCaptureReader, AsbCaptureWriter, ASB_CAPTURE_TX
+from asysbuslib.asb_proto import AsbCommand, AsbMessageType, AsbMeta, AsbPacket
+
+
+def test_capture_records_node_lifecycle_broadcasts(tmp_path):
+    path = str(tmp_path / "capture")
+    boot = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_BROADCAST, -1, 0x0000, 0x123), 1, [AsbCommand.ASB_CMD_BOOT])
+    heartbeat = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_BROADCAST, -1, 0x0000, 0x123), 3,
+                          [AsbCommand.ASB_CMD_HEARTBEAT, 1, 0])
+    state = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, 0x1001, 0x123), 2, [AsbCommand.ASB_CMD_1B, 1])
+
+    writer = AsbCaptureWriter(path)
+    assert writer.write(boot, timestamp_ns=1000)
+    assert writer.write(heartbeat, timestamp_ns=2000)
+    assert writer.write(state, ASB_CAPTURE_TX, timestamp_ns=3000)
+    writer.close()
+    assert writer.skipped == 0
+
+    with AsbCaptureReader(path) as reader:
+        assert list(reader.packets()) == [(1000, boot, 0), (2000, heartbeat, 0), (3000, state, ASB_CAPTURE_TX)]
@@ -0,0 +1,81 @@
+import numpy as np
+
+from asysbuslib.asb_batch import AsbPacketBatch
+from asysbuslib.asb_binary import asb_binary_decode, asb_binary_encode
+from asysbuslib.asb_can import asb_can_id_decode, asb_can_id_encode
+from asysbuslib.asb_endecode import asb_pkg_decode, asb_pkg_decode_bytes, asb_pkg_encode_bytes, asb_validate_pkg
+from asysbuslib.asb_interface import AsbInterface
+from asysbuslib.asb_proto import AsbCommand, AsbMessageType, AsbMeta, AsbPacket
+from asysbuslib.asb_stream import AsbStreamDecoder
+
+# what src/asb_uart.cpp sends for the boot message of node 0x123: asbSend(ASB_PKGTYPE_BROADCAST, 0x00, ...)
+FIRMWARE_BOOT = b'\x010\x1f0\x1f123\x1fFF\x1f1\x0221\x1f\x04\r\n'
+# heartbeat of the same node, uptime bytes 0x01 and 0x00
+FIRMWARE_HEARTBEAT = b'\x010\x1f0\x1f123\x1fFF\x1f3\x0222\x1f1\x1f0\x1f\x04\r\n'
+
+BOOT = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_BROADCAST, -1, 0x0000, 0x123), 1, [AsbCommand.ASB_CMD_BOOT])
+
+
+def test_firmware_boot_frame_decodes():
+    assert asb_pkg_decode(FIRMWARE_BOOT.decode()).meta.target == 0x0000  # port stays 0xFF there
+    assert asb_pkg_decode_bytes(FIRMWARE_BOOT) == BOOT
+    assert AsbStreamDecoder().feed(FIRMWARE_BOOT) == [BOOT]
+    assert AsbPacketBatch.from_bytes(FIRMWARE_BOOT).to_packets() == [BOOT]
+    assert asb_validate_pkg(BOOT)
+
+
+def test_broadcast_target_zero_round_trips():
+    assert asb_pkg_encode_bytes(BOOT) == FIRMWARE_BOOT
+
+    can_id = asb_can_id_encode(BOOT.meta)
+    assert can_id == 0x123
+    assert asb_can_id_decode(can_id) == BOOT.meta
+
+    frame = asb_binary_encode(BOOT)
+    assert asb_binary_decode(frame.strip(b'\xc0')) == BOOT
+
+    batch = AsbPacketBatch.from_packets([BOOT])
+    assert np.array_equal(batch.can_ids(), [0x123])
+
+
+def test_target_zero_only_for_broadcast():
+    for mtype, port in ((AsbMessageType.ASB_PKGTYPE_MULTICAST, -1), (AsbMessageType.ASB_PKGTYPE_UNICAST, 1)):
+        pkg = AsbPacket(AsbMeta(mtype, port, 0x0000, 0x123), 1, [0x51])
+        assert not asb_validate_pkg(pkg)
+        assert asb_pkg_encode_bytes(pkg) == b''
+        assert asb_can_id_encode(pkg.meta) == 0
+
+    assert asb_pkg_decode_bytes(b'\x011\x1f0\x1f123\x1fFF\x1f1\x0251\x1f\x04') is None
+
+
+class _StreamComm:
+    """ Decodes raw serial bytes like AsbUart """
+
+    def __init__(self) -> None:
+        self.callbacks = []
+        self.decoder = AsbStreamDecoder()
+
+    def register_callback(self, callback) -> None:
+        self.callbacks.append(callback)
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        return True
+
+    def receive(self, data: bytes) -> None:
+        for pkg in self.decoder.feed(data):
+            for callback in self.callbacks:
+                callback(pkg)
+
+
+def test_interface_node_discovery_from_firmware_frames():
+    comm = _StreamComm()
+    interface = AsbInterface(0x7F0, comm)
+    try:
+        comm.receive(FIRMWARE_BOOT + FIRMWARE_HEARTBEAT)
+        node = interface.get_node(0x123)
+    finally:
+        interface.stop()
+
+    assert node is not None
+    assert node.boot_time > 0
+    assert node.reported_uptime_days == 0
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import random
+import threading
+
+import pytest
+
+from asysbuslib.asb_interface import AsbInterface
+from asysbuslib.asb_mqtt import AsbMqttBridge, AsbMqttPublisher
+from asysbuslib.asb_proto import AsbCommand, AsbMessageType, AsbMeta, AsbPacket
+
+
+class FakeBroker:
+    """
+    In-process stand-in for an MQTT broker
+
+    publish records the message when it is called (sent) and returns after the round trip time
+    (acknowledged), like a QoS 1 publish. Topics in fail raise once instead of being acknowledged.
+    """
+
+    def __init__(self, rtt: float = 0.002, jitter: float = 0.0) -> None:
+        self.rtt = rtt
+        self.jitter = jitter
+        self.received: list[tuple[str, bytes, bool]] = []
+        self.fail: set[str] = set()
+        self.outstanding = 0
+        self.max_outstanding = 0
+
+    async def publish(self, topic: str, payload: bytes, retain: bool) -> None:
+        self.received.append((topic, payload, retain))
+        self.outstanding += 1
+        self.max_outstanding = max(self.max_outstanding, self.outstanding)
+        try:
+            await asyncio.sleep(self.rtt + random.uniform(0, self.jitter))
+            if topic in self.fail:
+                self.fail.discard(topic)
+                raise ConnectionError("broker unavailable")
+        finally:
+            self.outstanding -= 1
+
+
+async def publish_all(publisher: AsbMqttPublisher, messages: list[tuple[str, bytes, bool]]) -> list[bool]:
+    task = asyncio.ensure_future(publisher.run())
+    try:
+        results = [publisher.put(*message) for message in messages]
+        await publisher.drain()
+    finally:
+        task.cancel()
+    return results
+
+
+def test_publisher_window_limit():
+    async def run():
+        broker = FakeBroker()
+        publisher = AsbMqttPublisher(broker.publish, window=4)
+        await publish_all(publisher, [(f"/t/{i}", b"1", False) for i in range(50)])
+        return broker, publisher
+
+    broker, publisher = asyncio.run(run())
+    assert broker.max_outstanding == 4
+    assert publisher.max_in_flight == 4
+    assert publisher.published == 50
+    assert publisher.in_flight == 0
+
+
+def test_publisher_window_one_waits_for_every_message():
+    async def run():
+        broker = FakeBroker()
+        publisher = AsbMqttPublisher(broker.publish, window=1)
+        await publish_all(publisher, [(f"/t/{i}", b"1", False) for i in range(5)])
+        return broker
+
+    assert asyncio.run(run()).max_outstanding == 1
+
+
+def test_publisher_keeps_order():
+    messages = [(f"/t/{i % 7}", str(i).encode(), False) for i in range(200)]
+
+    async def run():
+        broker = FakeBroker(rtt=0.001, jitter=0.003)
+        publisher = AsbMqttPublisher(broker.publish, window=16)
+        await publish_all(publisher, messages)
+        return broker
+
+    assert asyncio.run(run()).received == messages
+
+
+def test_publisher_skips_unchanged_retained():
+    async def run():
+        broker = FakeBroker()
+        publisher = AsbMqttPublisher(broker.publish)
+        results = await publish_all(publisher, [
+            ("/t/a", b"1", True),
+            ("/t/a", b"1", True),  # unchanged
+            ("/t/a", b"0", True),
+            ("/t/b", b"1", False),
+            ("/t/b", b"1", False),  # not retained, always published
+        ])
+        publisher.forget_retained()
+        results += await publish_all(publisher, [("/t/a", b"0", True)])
+        return broker, publisher, results
+
+    broker, publisher, results = asyncio.run(run())
+    assert results == [True, False, True, True, True, True]
+    assert publisher.skipped == 1
+    assert [payload for topic, payload, _ in broker.received if topic == "/t/a"] == [b"1", b"0", b"0"]
+
+
+def test_publisher_failure_forgets_retained():
+    async def run():
+        broker = FakeBroker()
+        broker.fail.add("/t/a")
+        publisher = AsbMqttPublisher(broker.publish)
+        first = await publish_all(publisher, [("/t/a", b"1", True)])
+        second = await publish_all(publisher, [("/t/a", b"1", True)])
+        return broker, publisher, first + second
+
+    broker, publisher, results = asyncio.run(run())
+    assert results == [True, True]  # not skipped, the broker never acknowledged the first one
+    assert publisher.failed == 1
+    assert publisher.published == 1
+    assert len(broker.received) == 2
+
+
+class _LoopbackComm:
+    def __init__(self) -> None:
+        self.callbacks = []
+
+    def register_callback(self, callback) -> None:
+        self.callbacks.append(callback)
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        return True
+
+    def receive(self, pkg: AsbPacket) -> None:
+        for callback in self.callbacks:
+            callback(pkg)
+
+
+def _multicast(group: int, cmd: int, value: int) -> AsbPacket:
+    return AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, group, 0x10), 2, [cmd, value])
+
+
+def test_bridge_republish_after_reconnect():
+    async def run():
+        comm = _LoopbackComm()
+        interface = AsbInterface(0x7F0, comm)
+        broker = FakeBroker()
+        publisher = AsbMqttPublisher(broker.publish)
+        bridge = AsbMqttBridge(interface, publisher.put, forget=publisher.forget_retained)
+        try:
+            comm.receive(_multicast(0x1001, AsbCommand.ASB_CMD_1B, 1))
+            comm.receive(_multicast(0x1002, AsbCommand.ASB_CMD_PER, 42))
+            await publish_all(publisher, [])
+            before = len(broker.received)
+
+            count = bridge.republish()
+            await publish_all(publisher, [])
+        finally:
+            bridge.stop()
+            interface.stop()
+        return broker, before, count
+
+    broker, before, count = asyncio.run(run())
+    assert count == 2
+    assert broker.received[before:] == broker.received[:before]
+
+
+def _boot(node: int) -> AsbPacket:
+    return AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_BROADCAST, -1, 0x0000, node), 1, [AsbCommand.ASB_CMD_BOOT])
+
+
+def test_bridge_publishes_repeated_value_after_boot():
+    async def run():
+        comm = _LoopbackComm()
+        interface = AsbInterface(0x7F0, comm)
+        broker = FakeBroker()
+        publisher = AsbMqttPublisher(broker.publish)
+        bridge = AsbMqttBridge(interface, publisher.put, forget=publisher.forget_retained)
+        try:
+            comm.receive(_multicast(0x1001, AsbCommand.ASB_CMD_1B, 1))
+            comm.receive(_multicast(0x1001, AsbCommand.ASB_CMD_1B, 1))  # unchanged
+            comm.receive(_boot(0x10))
+            comm.receive(_multicast(0x1001, AsbCommand.ASB_CMD_1B, 1))
+            await publish_all(publisher, [])
+        finally:
+            bridge.stop()
+            interface.stop()
+        return broker
+
+    topics = [topic for topic, _, _ in asyncio.run(run()).received]
+    assert topics == ["/asysbus/1001/get/switch", "/asysbus/0010/lastboot", "/asysbus/1001/get/switch"]
+
+
+def test_bridge_publishes_lastboot_from_firmware_frame():
+    """ The boot broadcast of the firmware (target 0) decoded by AsbUart from a pseudo terminal """
+    pty = pytest.importorskip("pty")
+    tty = pytest.importorskip("tty")
+    from asysbuslib.asb_uart import AsbUart
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    uart = AsbUart(os.ttyname(slave), 115200)
+    interface = AsbInterface(0x7F0, uart)
+    published = []
+    received = threading.Event()
+
+    def publish(topic: str, payload: bytes, retain: bool) -> None:
+        published.append((topic, payload, retain))
+        received.set()
+
+    bridge = AsbMqttBridge(interface, publish)
+    try:
+        os.write(master, b'\x010\x1f0\x1f123\x1fFF\x1f1\x0221\x1f\x04\r\n')  # asbSend(ASB_PKGTYPE_BROADCAST, 0x00, ...)
+        assert received.wait(2)
+    finally:
+        bridge.stop()
+        interface.stop()
+        uart.stop()
+        os.close(master)
+        os.close(slave)
+
+    (topic, payload, retain), = published
+    assert topic == "/asysbus/0123/lastboot"
+    assert float(payload) > 0
+    assert not retain
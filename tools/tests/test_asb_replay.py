@@ -0,0 +1,71 @@
+import time
+
+from asysbuslib.asb_capture import AsbCaptureWriter, asb_capture_files
+from asysbuslib.asb_proto import AsbCommand, AsbMessageType, AsbMeta, AsbPacket
+from asysbuslib.asb_replay import AsbReplayComm
+
+SEC = 1_000_000_000
+
+
+def _state(value: int) -> AsbPacket:
+    return AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, 0x1001, 0x123), 2, [AsbCommand.ASB_CMD_PER, value])
+
+
+def _write_sessions(path: str, sessions: list[list[int]]) -> list[str]:
+    """ Write one capture file per session (the writer rotates on open), timestamps in ns """
+    value = 0
+    for timestamps in sessions:
+        writer = AsbCaptureWriter(path)
+        for timestamp in timestamps:
+            writer.write(_state(value), timestamp_ns=timestamp)
+            value += 1
+        writer.close()
+    return asb_capture_files(path)
+
+
+def _replay(files: list[str], speed: float) -> tuple[AsbReplayComm, list[AsbPacket]]:
+    replay = AsbReplayComm(files, speed)
+    received = []
+    replay.register_callback(received.append)
+    replay.start()
+    assert replay.wait(5)
+    replay.stop()
+    return replay, received
+
+
+def test_replay_skips_the_time_between_sessions(tmp_path):
+    # the second session starts an hour later on the same monotonic clock
+    files = _write_sessions(str(tmp_path / "capture"), [[10 * SEC, 10 * SEC + SEC // 10],
+                                                       [3610 * SEC, 3610 * SEC + SEC // 10]])
+    assert len(files) == 2
+
+    replay, received = _replay(files, 1.0)
+    assert [pkg.data[1] for pkg in received] == [0, 1, 2, 3]
+    assert 0.15 < replay.elapsed < 1.0
+
+
+def test_replay_speed(tmp_path):
+    files = _write_sessions(str(tmp_path / "capture"), [[0, SEC // 2, SEC]])
+
+    replay, received = _replay(files, 4.0)
+    assert len(received) == 3
+    assert 0.2 <= replay.elapsed < 0.6
+
+    replay, received = _replay(files, 0)
+    assert len(received) == 3
+    assert replay.elapsed < 0.2
+
+
+def test_stop_interrupts_waiting(tmp_path):
+    files = _write_sessions(str(tmp_path / "capture"), [[0, 60 * SEC]])
+    replay = AsbReplayComm(files, 1.0)
+    replay.start()
+    deadline = time.monotonic() + 2
+    while replay.frames < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    begin = time.monotonic()
+    replay.stop()
+    assert time.monotonic() - begin < 0.5
+    assert replay.frames == 1
+    assert replay.wait(0)
@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from asysbuslib.asb_interface import AsbInterface
+from asysbuslib.asb_proto import AsbCommand, AsbMessageType
+from asysbuslib.asb_sim import AsbLoopbackBus, AsbSimComm, AsbSimNode
+
+
+def _wait_for(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.mark.parametrize("codec", [None, "ascii", "binary"])
+def test_node_lifecycle_messages_reach_the_interface(codec):
+    bus = AsbLoopbackBus(codec)
+    interface = AsbInterface(0x7F0, AsbSimComm(bus))
+    broadcasts = []
+    interface.subscribe(broadcasts.append, AsbMessageType.ASB_PKGTYPE_BROADCAST)
+    node = AsbSimNode(bus, 0x123, heartbeat_interval=0.02)
+    try:
+        node.start()
+        assert _wait_for(lambda: len(broadcasts) >= 2)
+    finally:
+        node.stop()
+        interface.stop()
+        bus.stop()
+
+    # like the firmware: boot and heartbeat are broadcasts to target 0
+    assert [pkg.data[0] for pkg in broadcasts[:2]] == [AsbCommand.ASB_CMD_BOOT, AsbCommand.ASB_CMD_HEARTBEAT]
+    assert all(pkg.meta.target == 0x0000 for pkg in broadcasts)
+
+    info = interface.get_node(0x123)
+    assert info.boot_time > 0
+    assert info.reported_uptime_days == 0
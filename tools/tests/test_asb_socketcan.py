@@ -0,0 +1,168 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from asysbuslib import asb_socketcan
+from asysbuslib.asb_can import asb_can_id_encode, asb_can_id_filter
+from asysbuslib.asb_proto import AsbMessageType, AsbMeta, AsbPacket
+from asysbuslib.asb_socketcan import asb_socketcan_filters, asb_socketcan_pack_filters, AsbSocketCan, CAN_EFF_FLAG, \
+    CAN_ERR_FLAG, CAN_RTR_FLAG
+
+VCAN = "vcan0"
+
+
+def _vcan_available() -> bool:
+    if not hasattr(socket, "AF_CAN"):
+        return False
+    try:
+        with socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW) as sock:
+            sock.bind((VCAN,))
+    except OSError:
+        return False
+    return True
+
+
+needs_vcan = pytest.mark.skipif(not _vcan_available(), reason=f"SocketCAN interface {VCAN} not available")
+
+
+def _multicast(group: int, value: int = 1, source: int = 0x10) -> AsbPacket:
+    return AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, group, source), 2, [0x51, value])
+
+
+def _frame(can_id: int, data: bytes = b"\x51\x01") -> bytes:
+    return asb_socketcan._CAN_FRAME.pack(can_id, len(data), data)
+
+
+class _Receiver:
+    def __init__(self, count: int = 1, delay: float = 0.0) -> None:
+        self.packets: list[AsbPacket] = []
+        self.delay = delay
+        self._count = count
+        self._done = threading.Event()
+
+    def __call__(self, pkg: AsbPacket) -> None:
+        self.packets.append(pkg)
+        if self.delay and len(self.packets) == 1:
+            time.sleep(self.delay)
+        if len(self.packets) >= self._count:
+            self._done.set()
+
+    def wait(self, timeout: float = 2.0) -> bool:
+        return self._done.wait(timeout)
+
+
+def test_decode_frame():
+    pkg = _multicast(0x1001, 1)
+    can_id = asb_can_id_encode(pkg.meta)
+
+    assert AsbSocketCan._decode_frame(_frame(can_id | CAN_EFF_FLAG)) == pkg
+    assert AsbSocketCan._decode_frame(_frame(can_id | CAN_EFF_FLAG)[:-1]) is None
+    assert AsbSocketCan._decode_frame(_frame(can_id & 0x7FF)) is None  # standard frame
+    assert AsbSocketCan._decode_frame(_frame(can_id | CAN_EFF_FLAG | CAN_RTR_FLAG)) is None
+    assert AsbSocketCan._decode_frame(_frame(can_id | CAN_EFF_FLAG | CAN_ERR_FLAG)) is None
+    assert AsbSocketCan._decode_frame(asb_socketcan._CAN_FRAME.pack(can_id | CAN_EFF_FLAG, 9, bytes(8))) is None
+
+    # boot and heartbeat of the firmware are broadcasts to target 0, other packets need a target
+    boot = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_BROADCAST, -1, 0x0000, 0x123), 1, [0x21])
+    assert AsbSocketCan._decode_frame(_frame(asb_can_id_encode(boot.meta) | CAN_EFF_FLAG, b"\x21")) == boot
+    assert AsbSocketCan._decode_frame(_frame((1 << 27) | 0x123 | CAN_EFF_FLAG)) is None  # multicast to group 0
+
+
+def test_filters_from_criteria():
+    multicast = asb_can_id_filter(AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1002)
+    assert asb_socketcan_filters([(AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1002, None)] * 2) == [multicast]
+
+    node = asb_can_id_filter(AsbMessageType.ASB_PKGTYPE_UNICAST, 0x7F0)
+    assert asb_socketcan_filters([(AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1002, None)], 0x7F0) == sorted([multicast, node])
+    assert asb_socketcan_filters([], 0x7F0) == [node]
+
+    # one selection of all packets needs no filter at all
+    assert asb_socketcan_filters([(AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1002, None), (None, None, None)], 0x7F0) is None
+
+
+def test_pack_filters():
+    can_id, mask = asb_can_id_filter(AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1002)
+    raw = asb_socketcan_pack_filters([(can_id, mask), (0, 0)])
+    assert [asb_socketcan._CAN_FILTER.unpack_from(raw, offset) for offset in (0, asb_socketcan._CAN_FILTER.size)] == [
+        (can_id | CAN_EFF_FLAG, mask | CAN_EFF_FLAG | CAN_RTR_FLAG),
+        (CAN_EFF_FLAG, CAN_EFF_FLAG | CAN_RTR_FLAG),
+    ]
+    # without filters only extended data frames pass
+    assert asb_socketcan_pack_filters(None) == raw[asb_socketcan._CAN_FILTER.size:]
+
+
+@needs_vcan
+def test_round_trip():
+    sender = AsbSocketCan(VCAN)
+    receiver = AsbSocketCan(VCAN)
+    received = _Receiver()
+    receiver.register_callback(received)
+    try:
+        unicast = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_UNICAST, 0x05, 0x123, 0x10), 3, [0x40, 1, 2])
+        assert sender.send_packet(unicast)
+        assert received.wait()
+        assert received.packets == [unicast]
+
+        invalid = AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, 0x1001, 0x10), 9, list(range(9)))
+        assert not sender.send_packet(invalid)
+    finally:
+        sender.stop()
+        receiver.stop()
+
+
+@needs_vcan
+def test_batch_receive(monkeypatch):
+    wakeups = []
+    real_select = asb_socketcan.select.select
+
+    def counting_select(*args):
+        ready = real_select(*args)
+        if ready[0]:
+            wakeups.append(time.monotonic())
+        return ready
+
+    monkeypatch.setattr(asb_socketcan.select, "select", counting_select)
+
+    count = 200
+    sender = AsbSocketCan(VCAN)
+    receiver = AsbSocketCan(VCAN)
+    received = _Receiver(count, delay=0.05)  # the first callback blocks, so the rest queues up in the socket
+    receiver.register_callback(received)
+    try:
+        packets = [_multicast(0x1000 + i, i % 2) for i in range(count)]
+        for pkg in packets:
+            assert sender.send_packet(pkg)
+        assert received.wait()
+    finally:
+        sender.stop()
+        receiver.stop()
+
+    assert received.packets == packets
+    assert len(wakeups) <= count // asb_socketcan.ASB_SOCKETCAN_MAX_BATCH + 2
+
+
+@needs_vcan
+def test_kernel_filters():
+    sender = AsbSocketCan(VCAN)
+    receiver = AsbSocketCan(VCAN)
+    received = _Receiver()
+    receiver.register_callback(received)
+    try:
+        receiver.set_filters_from_criteria([(AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1002, None)])
+        assert sender.send_packet(_multicast(0x1001))
+        assert sender.send_packet(_multicast(0x1003))
+        assert sender.send_packet(_multicast(0x1002))
+        assert received.wait()
+        time.sleep(0.05)
+        assert [pkg.meta.target for pkg in received.packets] == [0x1002]
+
+        received.packets.clear()
+        receiver.set_filters(None)
+        assert sender.send_packet(_multicast(0x1001))
+        time.sleep(0.1)
+        assert [pkg.meta.target for pkg in received.packets] == [0x1001]
+    finally:
+        sender.stop()
+        receiver.stop()
@@ -0,0 +1,276 @@
+# Micro benchmarks for asysbuslib, run with pytest-benchmark
+#
+# Record a baseline and compare a change against it on the same machine:
+#   python -m pytest tests/test_benchmarks.py --benchmark-save=baseline
+#   python -m pytest tests/test_benchmarks.py --benchmark-compare --benchmark-compare-fail=mean:30%
+# Results are stored per machine in .benchmarks, single results vary by about 20 % between runs.
+# --benchmark-disable runs every benchmark once as a plain test.
+import collections
+import os
+import threading
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from asysbuslib.asb_comm import AsbComm
+from asysbuslib.asb_endecode import asb_pkg_decode, asb_pkg_decode_bytes, asb_pkg_encode, asb_pkg_encode_bytes, \
+    asb_pkg_encode_into, asb_validate_pkg, ASB_PKG_ENCODED_MAX_LEN
+from asysbuslib.asb_interface import AsbInterface
+from asysbuslib.asb_mqtt import AsbMqttBridge
+from asysbuslib.asb_proto import AsbCommand, AsbCompactPacket, AsbMessageType, AsbMeta, AsbPacket
+from asysbuslib.asb_sim import AsbLoopbackBus, AsbSimComm
+from asysbuslib.asb_stream import AsbStreamDecoder
+
+# frames per benchmark round
+FRAMES = 1000
+
+
+def _sample_packets() -> list[AsbPacket]:
+    return [
+        AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, 0x1001, 0x123), 2, [AsbCommand.ASB_CMD_1B, 1]),
+        AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, 0xA2F0, 0x7FF), 2, [AsbCommand.ASB_CMD_PER, 100]),
+        AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_UNICAST, 0x1F, 0x0012, 0x001), 1, [AsbCommand.ASB_CMD_PING]),
+        AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_BROADCAST, -1, 0x0000, 0x42), 3, [AsbCommand.ASB_CMD_S_TEMP, 0x00, 0xE1]),
+        AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_UNICAST, 0, 0x0123, 0x010), 6, [AsbCommand.ASB_CMD_RES_MODULES, 1, 2, 0, 0x20, 8]),
+    ]
+
+
+def _frames(benchmark, count: int) -> None:
+    # pytest-benchmark reports rounds per second, frames per round turn it into frames per second
+    benchmark.extra_info["frames"] = count
+
+
+def test_decode_regex(benchmark):
+    lines = [asb_pkg_encode(pkg) for pkg in _sample_packets()] * (FRAMES // 5)
+    _frames(benchmark, len(lines))
+
+    pkgs = benchmark(lambda: [asb_pkg_decode(line) for line in lines])
+    assert all(pkgs)
+
+
+def test_decode_bytes(benchmark):
+    lines = [asb_pkg_encode_bytes(pkg) for pkg in _sample_packets()] * (FRAMES // 5)
+    _frames(benchmark, len(lines))
+
+    pkgs = benchmark(lambda: [asb_pkg_decode_bytes(line) for line in lines])
+    assert all(pkgs)
+
+
+def test_encode_str(benchmark):
+    pkgs = _sample_packets() * (FRAMES // 5)
+    _frames(benchmark, len(pkgs))
+
+    lines = benchmark(lambda: [asb_pkg_encode(pkg) for pkg in pkgs])
+    assert all(lines)
+
+
+def test_encode_bytes(benchmark):
+    pkgs = _sample_packets() * (FRAMES // 5)
+    _frames(benchmark, len(pkgs))
+
+    lines = benchmark(lambda: [asb_pkg_encode_bytes(pkg) for pkg in pkgs])
+    assert all(lines)
+
+
+def test_encode_into(benchmark):
+    pkgs = _sample_packets() * (FRAMES // 5)
+    buf = bytearray(ASB_PKG_ENCODED_MAX_LEN * len(pkgs))
+    _frames(benchmark, len(pkgs))
+
+    def encode_into() -> int:
+        offset = 0
+        for pkg in pkgs:
+            offset += asb_pkg_encode_into(buf, offset, pkg)
+        return offset
+
+    assert benchmark(encode_into) > 0
+
+
+def test_validate(benchmark):
+    pkgs = _sample_packets() * (FRAMES // 5)
+    _frames(benchmark, len(pkgs))
+
+    assert all(benchmark(lambda: [asb_validate_pkg(pkg) for pkg in pkgs]))
+
+
+def test_stream_decoder(benchmark):
+    stream = b"".join(asb_pkg_encode_bytes(pkg) for pkg in _sample_packets()) * (FRAMES // 5)
+    chunks = [stream[i:i + 64] for i in range(0, len(stream), 64)]  # roughly what a serial read returns
+    _frames(benchmark, FRAMES)
+
+    # a new decoder every round, the split frame at the end of a round must not leak into the next
+    pkgs = benchmark(lambda: AsbStreamDecoder().decode_many(chunks))
+    assert len(pkgs) == FRAMES
+
+
+def test_interface_callback(benchmark):
+    subscriptions = 500
+    nodes = 200
+    bus = AsbLoopbackBus()
+    interface = AsbInterface(0x7F0, AsbSimComm(bus))
+
+    # known nodes (the modules requests go to the bus, nobody answers)
+    for source in range(1, nodes + 1):
+        interface._callback(AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_BROADCAST, -1, 0x0000, source), 1, [AsbCommand.ASB_CMD_BOOT]))
+
+    for i in range(subscriptions):
+        if i % 2:
+            interface.subscribe(lambda pkg: None, AsbMessageType.ASB_PKGTYPE_MULTICAST, 0x1000 + i)
+        else:
+            interface.subscribe(lambda pkg: None, target=0x1000 + i, cmd=AsbCommand.ASB_CMD_1B)
+
+    pkgs = [
+        AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, 0x1000 + i % subscriptions, 1 + i % nodes), 2, [AsbCommand.ASB_CMD_1B, i % 2])
+        for i in range(FRAMES)
+    ]
+    _frames(benchmark, len(pkgs))
+    benchmark.extra_info["subscriptions"] = subscriptions
+    benchmark.extra_info["nodes"] = nodes
+
+    try:
+        benchmark(lambda: [interface._callback(pkg) for pkg in pkgs])
+    finally:
+        bus.stop()
+        interface.stop()
+
+
+class _EncodingComm(AsbComm):
+    """ Encodes sent packets like AsbUart, without a port """
+
+    def __init__(self) -> None:
+        self.sent: collections.deque[bytes] = collections.deque(maxlen=1024)
+
+    def register_callback(self, callback) -> None:
+        pass
+
+    def send_packet(self, pkg: AsbPacket) -> bool:
+        message = asb_pkg_encode_bytes(pkg)
+        self.sent.append(message)
+        return bool(message)
+
+
+def _bridge() -> tuple[AsbInterface, AsbMqttBridge]:
+    interface = AsbInterface(0x7F0, _EncodingComm())
+    published: collections.deque[tuple] = collections.deque(maxlen=1024)
+    return interface, AsbMqttBridge(interface, lambda topic, payload, retain: published.append((topic, payload, retain)))
+
+
+def test_mqtt_bus_to_mqtt(benchmark):
+    groups = 64
+    interface, bridge = _bridge()
+
+    # UART bytes to publish calls, every packet changes the state of its group
+    stream = b"".join(
+        asb_pkg_encode_bytes(AsbPacket(AsbMeta(AsbMessageType.ASB_PKGTYPE_MULTICAST, -1, 0x1000 + i % groups, 1 + i % 50), 2,
+                                       [AsbCommand.ASB_CMD_1B if i % 2 else AsbCommand.ASB_CMD_PER, i // groups % 2]))
+        for i in range(FRAMES)
+    )
+    callback = interface._callback
+    _frames(benchmark, FRAMES)
+
+    def bus_to_mqtt() -> None:
+        for pkg in AsbStreamDecoder().iter_feed(stream):
+            callback(pkg)
+
+    try:
+        benchmark(bus_to_mqtt)
+    finally:
+        interface.stop()
+    assert bridge.bus_messages > 0
+
+
+def test_mqtt_mqtt_to_bus(benchmark):
+    groups = 64
+    interface, bridge = _bridge()
+
+    # set messages to encoded packets, each also publishes the new state
+    messages = [(f"/asysbus/{0x2000 + i % groups:04x}/set/{'switch' if i % 2 else 'level'}", str(i // groups % 2).encode())
+                for i in range(FRAMES)]
+    handle = bridge.handle_message
+    _frames(benchmark, len(messages))
+
+    try:
+        benchmark(lambda: [handle(topic, payload) for topic, payload in messages])
+    finally:
+        interface.stop()
+
+
+def test_uart_round_trip(benchmark):
+    pty = pytest.importorskip("pty")
+    tty = pytest.importorskip("tty")
+    from asysbuslib.asb_uart import AsbUart
+
+    pkgs = _sample_packets()
+    count = FRAMES  # limited by the pty, not by the library
+
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    uart = AsbUart(os.ttyname(slave), 115200)
+
+    received = 0
+    done = threading.Event()
+
+    def callback(pkg: AsbPacket) -> None:
+        nonlocal received
+        received += 1
+        if received == count:
+            done.set()
+
+    uart.register_callback(callback)
+
+    # the node side echoes everything AsbUart sends until the pty is closed
+    def echo() -> None:
+        try:
+            while True:
+                os.write(master, os.read(master, 4096))
+        except OSError:
+            pass
+
+    threading.Thread(target=echo, daemon=True).start()
+
+    def round_trip() -> int:
+        nonlocal received
+        received = 0
+        done.clear()
+        for i in range(count):
+            uart.send_packet(pkgs[i % len(pkgs)])
+        done.wait(30)
+        return received
+
+    _frames(benchmark, count)
+    try:
+        result = benchmark.pedantic(round_trip, rounds=5)
+    finally:
+        uart.stop()
+        os.close(master)
+        os.close(slave)
+    assert result == count
+
+
+@pytest.mark.parametrize("convert", [lambda pkg: pkg, AsbCompactPacket.from_packet], ids=["AsbPacket", "AsbCompactPacket"])
+def test_packet_memory(benchmark, convert):
+    lines = [asb_pkg_encode_bytes(pkg) for pkg in _sample_packets()] * (FRAMES // 5)
+    _frames(benchmark, len(lines))
+
+    tracemalloc.start()
+    pkgs = [convert(asb_pkg_decode_bytes(line)) for line in lines]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # exclude the list holding the packets
+    benchmark.extra_info["bytes_per_packet"] = round((size - 8 * len(pkgs)) / len(pkgs))
+
+    benchmark(lambda: [convert(asb_pkg_decode_bytes(line)) for line in lines])
+
+
+def test_batch_decode(benchmark):
+    pytest.importorskip("numpy")
+    from asysbuslib.asb_batch import AsbPacketBatch
+
+    raw = b"".join(asb_pkg_encode_bytes(pkg) for pkg in _sample_packets()) * (FRAMES // 5)
+    _frames(benchmark, FRAMES)
+
+    batch = benchmark(lambda: AsbPacketBatch.from_bytes(raw))
+    assert len(batch) == FRAMES